@@ -18,8 +18,8 @@ setup(
     package_dir={"": "src"},
     packages=find_packages(where="src"),
     install_requires=[
-        "tensorflow>=2",
-        "scikit-learn>=0.22",
+        "tensorflow>=2.8",
+        "scikit-learn>=1.0",
         "uproot>=3",
         "matplotlib>=3",
         "numpy>=1"
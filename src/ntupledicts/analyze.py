@@ -13,8 +13,43 @@ efficiency of track finding or a prediction by an ML model.
 from . import operations as ndops
 from .operations import select as sel
 from numpy import linspace
+from numpy import ones
+from numpy import count_nonzero
+from numpy import arange
+from numpy import argsort
+from numpy import bincount
+from numpy import asarray
+from numpy import searchsorted
+from numpy import concatenate
+from numpy import cumsum
+from numpy import ndarray
+from numpy import amax
+from numpy import amin
+from numpy import empty
+from numpy import full
+from numpy import isnan
+from numpy import nextafter
+from numpy import quantile
+from numpy import sort
+from numpy import sqrt as sqrt_array
+from numpy import unique
+from numpy import ascontiguousarray
+from collections import OrderedDict
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from math import ceil
+from math import inf
 from math import sqrt
 from statistics import stdev
+from random import Random
+from warnings import warn
+
+
+# Bin assignments and their sizes in bytes by (value list digest, bin
+# specifier), oldest first
+_BIN_CACHE_MAX_BYTES = 2 ** 27
+_bin_cache = OrderedDict()
 
 
 def get_proportion_selected(val_list, selector, norm=True):
@@ -26,7 +61,9 @@ def get_proportion_selected(val_list, selector, norm=True):
         val_list: a list of values of a track property, such as
             tp_pt or trk_chi2rphi.
         selector: a property that these value can satisfy. For
-            example, "lambda trk_eta: trk_eta <= 2.4".
+            example, "lambda trk_eta: trk_eta <= 2.4". Selectors that
+            work on numpy arrays run vectorized; see
+            ntupledicts.operations.val_list_mask().
         norm: if True, divides the number of tracks meeting the
             condition by the total number of tracks. This is the default
             option.
@@ -39,16 +76,17 @@ def get_proportion_selected(val_list, selector, norm=True):
     if len(val_list) == 0:
         return 0
 
-    num_tracks_meeting_cond = sum(map(selector, val_list))
+    num_tracks_meeting_cond = int(count_nonzero(
+        ndops.val_list_mask(val_list, selector)))
     return float(num_tracks_meeting_cond) / len(val_list) if norm \
             else num_tracks_meeting_cond
 
 
 def make_bins(bin_specifier, binning_values):
     """Takes in a bin specifier, which is either an integer number of
-    bins, a tuple of the form (lower_bound, upper_bound, num_bins) or
-    a list of values, with the last element being the upper bound of the
-    last bin.
+    bins, a tuple of the form (lower_bound, upper_bound, num_bins), a
+    tuple of the form ("quantile", num_bins), or a list of values, with
+    the last element being the upper bound of the last bin.
 
     If bin_specifier is an integer, it uses the max and min values of
     binned_property to find its range.
@@ -56,25 +94,50 @@ def make_bins(bin_specifier, binning_values):
     If bin_specifier is a 3-tuple, it creates the third argument number
     of evenly spaced bins between the first two values.
 
+    If bin_specifier is ("quantile", num_bins), it creates that many
+    bins holding (as nearly as possible) the same number of values.
+    The last bin edge is nudged just past the max value so that every
+    value lands in a bin.
+
     If bin_specifier is a list, return the list.
 
+    The binning values can also be a QuantileSketch built up from
+    chunks of streamed data, in which case the range and quantiles come
+    from the sketch rather than from a scan of a full value list.
+
     Args:
         bin_specifier: either an int for the number of bins, a 3-tuple
-            of the form (low_bound, high_bound, num_bins), or a list of
-            numbers
-        binning_values: a list of values forming the basis for the bins
+            of the form (low_bound, high_bound, num_bins), a 2-tuple of
+            the form ("quantile", num_bins), or a list of numbers
+        binning_values: a list of values forming the basis for the
+            bins, or a QuantileSketch of those values
 
     Returns:
         A list of bin edges, of length one greater than the number of
         bins.
 
     Raises:
-        ValueError if bin_specifier is not an int, tuple, or list
+        ValueError if bin_specifier is not an int, tuple, or list, or
+        if binning_values is an empty QuantileSketch and the bins
+        depend on it
     """
 
+    if isinstance(binning_values, QuantileSketch):
+        get_min_max = lambda: (binning_values.get_min(),
+                binning_values.get_max())
+        get_quantiles = binning_values.get_quantiles
+    else:
+        get_min_max = lambda: (amin(binning_values), amax(binning_values))
+        get_quantiles = lambda quantiles: list(quantile(
+            asarray(binning_values), quantiles))
+
     if isinstance(bin_specifier, int):
-        bin_specifier = (min(binning_values), max(binning_values),
-                bin_specifier)
+        bin_specifier = (*get_min_max(), bin_specifier)
+    if isinstance(bin_specifier, tuple) and len(bin_specifier) == 2 \
+            and bin_specifier[0] == "quantile":
+        bin_edges = get_quantiles(linspace(0, 1, bin_specifier[1] + 1))
+        bin_edges[-1] = nextafter(bin_edges[-1], inf)
+        return bin_edges
     if isinstance(bin_specifier, tuple):
         bin_specifier = list(bin_specifier)
         bin_specifier[2] += 1  # we'll need one more value than we want bins
@@ -86,7 +149,260 @@ def make_bins(bin_specifier, binning_values):
             "but received {}.".format(str(bin_specifier)))
 
 
-def take_measure_by_bin(track_prop_dict, bin_property, measure, bins=30):
+class QuantileSketch(object):
+    """A mergeable, fixed-memory summary of a stream of numeric values
+    from which approximate quantiles and the exact min and max can be
+    read. Use it to make bins for samples too large to hold in memory
+    at once: update it once per chunk, then hand it to make_bins().
+
+        sketch = QuantileSketch()
+        for chunk_track_prop_dict in chunks:
+            sketch.update(chunk_track_prop_dict["pt"])
+        bins = make_bins(("quantile", 20), sketch)
+
+    Sketches of different chunks (say, from different worker processes)
+    can be combined with merge().
+
+    This is a KLL sketch: values are kept in a stack of compactors, and
+    each value at level h stands in for 2^h of the values seen. When a
+    level fills, it is sorted and every other value (starting at a
+    random offset) is promoted a level. The rank error of a quantile is
+    on the order of one over the compactor size k. NaN values are
+    ignored.
+    """
+
+    def __init__(self, k=200, seed=None):
+        """Makes an empty sketch.
+
+        Args:
+            k: the size of the top compactor. Larger k gives more
+                accurate quantiles for more memory.
+            seed: a seed for the random compaction offsets, for
+                reproducability.
+        """
+
+        self._k = k
+        self._compactors = [empty(0)]
+        self._size = 0
+        self._min = inf
+        self._max = -inf
+        self._random = Random(seed)
+
+    def update(self, val_list):
+        """Adds a chunk of values, such as one value list of a track
+        properties dict, to the sketch."""
+
+        val_array = asarray(val_list, dtype=float)
+        val_array = val_array[~isnan(val_array)]
+        if not len(val_array):
+            return
+
+        self._size += len(val_array)
+        self._min = min(self._min, float(amin(val_array)))
+        self._max = max(self._max, float(amax(val_array)))
+        self._compactors[0] = concatenate([self._compactors[0], val_array])
+        self._compress()
+
+    def merge(self, other):
+        """Adds the contents of another QuantileSketch to this one."""
+
+        while len(self._compactors) < len(other._compactors):
+            self._compactors.append(empty(0))
+        for level, items in enumerate(other._compactors):
+            self._compactors[level] = concatenate(
+                    [self._compactors[level], items])
+
+        self._size += other._size
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        self._compress()
+
+    def size(self):
+        """Returns the number of values that have been added."""
+
+        return self._size
+
+    def get_min(self):
+        """Returns the exact smallest value added.
+
+        Raises:
+            ValueError: if no values have been added to the sketch.
+        """
+
+        if not self._size:
+            raise ValueError("Cannot take the min of an empty sketch.")
+
+        return self._min
+
+    def get_max(self):
+        """Returns the exact largest value added.
+
+        Raises:
+            ValueError: if no values have been added to the sketch.
+        """
+
+        if not self._size:
+            raise ValueError("Cannot take the max of an empty sketch.")
+
+        return self._max
+
+    def get_quantiles(self, quantiles):
+        """Returns a list of approximate values at each of the given
+        quantiles (numbers from zero to one). Quantiles of zero and one
+        give the exact min and max.
+
+        Raises:
+            ValueError: if no values have been added to the sketch.
+        """
+
+        if not self._size:
+            raise ValueError("Cannot take quantiles of an empty sketch.")
+
+        items = concatenate(self._compactors)
+        weights = concatenate(list(map(lambda level, level_items:
+            full(len(level_items), 2 ** level),
+            range(len(self._compactors)), self._compactors)))
+        item_order = argsort(items, kind="stable")
+        items = items[item_order]
+        rank_fractions = cumsum(weights[item_order]) / sum(weights)
+
+        return list(map(lambda q:
+            self._min if q <= 0 else self._max if q >= 1
+                else float(items[min(searchsorted(rank_fractions, q),
+                    len(items) - 1)]),
+            quantiles))
+
+    def _capacity(self, level):
+        """Returns the number of items a level can hold before it must
+        be compacted. Lower levels get geometrically smaller."""
+
+        depth = len(self._compactors) - 1 - level
+        return max(int(ceil(self._k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        """Compacts every level that is over capacity, bottom up."""
+
+        level = 0
+        while level < len(self._compactors):
+            items = self._compactors[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self._compactors):
+                    self._compactors.append(empty(0))
+                items = sort(items)
+                # An odd item out stays behind, the rest pair off
+                num_kept = len(items) % 2
+                offset = self._random.randint(0, 1)
+                promoted = items[num_kept:][offset::2]
+                self._compactors[level] = items[:num_kept]
+                self._compactors[level + 1] = concatenate(
+                        [self._compactors[level + 1], promoted])
+            level += 1
+
+
+def bin_val_list(val_list, bin_specifier):
+    """Assigns each value in a value list to a bin. Results are kept in
+    a least-recently-used cache keyed on a digest of the values and on
+    the bin specifier, so binning the same values the same way again
+    (say, for efficiency, fake rate, and chi2 mean all by eta) skips
+    both make_bins() and the bin assignment.
+
+    Because the key is the values themselves, changing a value list in
+    place can never return stale bins, and the cache holds no reference
+    to the value list. It holds only the bin assignments, and drops the
+    oldest of them past _BIN_CACHE_MAX_BYTES.
+
+    Args:
+        val_list: a list of values forming the basis for the bins.
+        bin_specifier: either an int for the number of bins, a 3-tuple
+            of the form (low_bound, high_bound, num_bins), or a list of
+            numbers. See make_bins() for info.
+
+    Returns:
+        The bins, a read-only numpy array of bin indices indexed by
+        track, and a list indexed by bin of read-only numpy arrays of
+        the indices of the tracks in that bin. The arrays are shared
+        with other callers through the cache. Values outside of the
+        bins are given bin index -1 or the number of bins and are in no
+        bin's index array. As with make_bins(), bins include their
+        lower edge but not their upper.
+    """
+
+    val_array = asarray(val_list)
+    cache_key = _bin_cache_key(val_array, bin_specifier)
+    if cache_key in _bin_cache:
+        _bin_cache.move_to_end(cache_key)
+        return _copy_binning(_bin_cache[cache_key][1])
+
+    bins = make_bins(bin_specifier, val_list)
+    bin_indices = searchsorted(bins, val_array, side="right") - 1
+
+    # Group track indices by bin with one stable sort
+    track_order = argsort(bin_indices, kind="stable")
+
+    # Binnings are shared between callers through the cache
+    bin_indices.flags.writeable = False
+    track_order.flags.writeable = False
+    bin_boundaries = searchsorted(bin_indices[track_order],
+            arange(len(bins)))
+    track_indices_by_bin = list(map(lambda start, end:
+        track_order[start:end],
+        bin_boundaries[:-1], bin_boundaries[1:]))
+
+    binning = tuple(bins), bin_indices, tuple(track_indices_by_bin)
+
+    if cache_key is not None:
+        _bin_cache[cache_key] = (bin_indices.nbytes + track_order.nbytes,
+                binning)
+        cache_bytes = sum(map(lambda entry: entry[0], _bin_cache.values()))
+        while cache_bytes > _BIN_CACHE_MAX_BYTES:
+            cache_bytes -= _bin_cache.popitem(last=False)[1][0]
+
+    return _copy_binning(binning)
+
+
+def _copy_binning(binning):
+    """Returns a binning from the bin cache with new lists of the bins
+    and of the per-bin index arrays, so callers can't change the cached
+    ones."""
+
+    bins, bin_indices, track_indices_by_bin = binning
+
+    return list(bins), bin_indices, list(track_indices_by_bin)
+
+
+def clear_bin_cache():
+    """Empties the cache of bin assignments used by bin_val_list()."""
+
+    _bin_cache.clear()
+
+
+def _bin_cache_key(val_array, bin_specifier):
+    """Returns the key for a binning in the bin cache: a digest of the
+    values, their type, and their shape, along with the bin specifier.
+    Returns None for arrays of objects, which aren't cached."""
+
+    if val_array.dtype.hasobject:
+        return None
+
+    val_hash = blake2b(digest_size=16)
+    val_hash.update(repr((val_array.dtype.str, val_array.shape)).encode())
+    val_hash.update(ascontiguousarray(val_array).data)
+
+    return val_hash.digest(), _bin_specifier_key(bin_specifier)
+
+
+def _bin_specifier_key(bin_specifier):
+    """Returns a hashable version of a bin specifier for use as part of
+    a cache key."""
+
+    if isinstance(bin_specifier, list):
+        return (list, tuple(bin_specifier))
+
+    return (type(bin_specifier), bin_specifier)
+
+
+def take_measure_by_bin(track_prop_dict, bin_property, measure, bins=30,
+                        executor=None):
     """Bin a track properties dict by a value list of a corresponding
     property, then compute some measure for the values in each bin. For
     example, the track_prop_dict could could be of tracking particles
@@ -102,28 +418,235 @@ def take_measure_by_bin(track_prop_dict, bin_property, measure, bins=30):
             returns a number and an error.
         bins: either an int for the number of bins, a 3-tuple of the
             form (low_bound, high_bound, num_bins), or a list of
-            numbers. See ntupledict.operations.make_bins() for info.
+            numbers. See make_bins() for info.
+        executor: a concurrent.futures executor on which to run the
+            measure for each bin, for expensive measures such as
+            fitting a function. If it is a ProcessPoolExecutor, numeric
+            value lists are sent to the workers through shared memory
+            rather than pickled, and the measure must be picklable
+            (e.g., a module-level function rather than a lambda). If
+            None, each bin is measured in turn in this process.
 
     Returns:
         The bins, bin heights, and errors computed from the binned value
         lists.
     """
 
-    binning_val_list = track_prop_dict[bin_property]
-    bins = make_bins(bins, binning_val_list)
+    bins, _, track_indices_by_bin = bin_val_list(
+            track_prop_dict[bin_property], bins)
+    bin_heights, bin_errs = _take_measure_by_bin_indices(track_prop_dict,
+            measure, track_indices_by_bin, executor)
+
+    return bins, bin_heights, bin_errs
 
-    # Sort values into bins with respect to binning value
-    bin_heights_and_errs = list(map(lambda lower_bin, upper_bin:
-        measure(ndops.cut_track_prop_dict(track_prop_dict,
-            # Select values in range lower_bin to upper_bin,
-            # but exclude values equal to upper_bin
-            {bin_property: lambda val: lower_bin <= val < upper_bin})),
-        bins[:-1], bins[1:]))
+
+def count_by_bin(val_list, bins=30):
+    """Counts the values in each bin in one pass, for histograms. The
+    bin assignment is shared with take_measure_by_bin() through the bin
+    cache, and only the counts (never the values) need be plotted.
+
+    Args:
+        val_list: a list or numpy array of values of a track property.
+        bins: either an int for the number of bins, a 3-tuple of the
+            form (low_bound, high_bound, num_bins), or a list of
+            numbers. See make_bins() for info.
+
+    Returns:
+        The bins, a list of the number of values in each bin, and a
+        list of the errors on those numbers (their square roots).
+    """
+
+    bins, _, track_indices_by_bin = bin_val_list(val_list, bins)
+    counts = asarray(list(map(len, track_indices_by_bin)))
+
+    return bins, counts.tolist(), sqrt_array(counts).tolist()
+
+
+def count_by_bin_2d(x_val_list, y_val_list, x_bins=30, y_bins=30):
+    """Counts the values in each cell of a 2D grid of bins in one pass,
+    for 2D histograms that stand in for scatter plots of many tracks.
+
+    Args:
+        x_val_list: a list or numpy array of values of a track
+            property, binned along the first axis.
+        y_val_list: a list or numpy array of values of another track
+            property of the same tracks, binned along the second axis.
+        x_bins, y_bins: either an int for the number of bins, a
+            3-tuple of the form (low_bound, high_bound, num_bins), or a
+            list of numbers. See make_bins() for info.
+
+    Returns:
+        The x bins, the y bins, and a 2D numpy array of counts indexed
+        by x bin and then y bin.
+    """
+
+    x_bins, x_bin_indices, _ = bin_val_list(x_val_list, x_bins)
+    y_bins, y_bin_indices, _ = bin_val_list(y_val_list, y_bins)
+    num_x_bins, num_y_bins = len(x_bins) - 1, len(y_bins) - 1
+
+    in_bins = (x_bin_indices >= 0) & (x_bin_indices < num_x_bins) \
+            & (y_bin_indices >= 0) & (y_bin_indices < num_y_bins)
+    counts = bincount(x_bin_indices[in_bins] * num_y_bins
+            + y_bin_indices[in_bins], minlength=num_x_bins * num_y_bins)
+
+    return x_bins, y_bins, counts.reshape(num_x_bins, num_y_bins)
+
+
+def count_values(val_list):
+    """Counts the occurrences of each distinct value in a value list
+    in one pass, for properties that take discrete values like pdgid or
+    hitpattern.
+
+    Args:
+        val_list: a list or numpy array of values of a track property.
+
+    Returns:
+        A sorted list of the distinct values, a list of the number of
+        occurrences of each, and a list of the errors on those numbers
+        (their square roots).
+    """
+
+    values, counts = unique(asarray(val_list), return_counts=True)
+
+    return list(values), list(counts), list(sqrt_array(counts))
+
+
+def take_measure_by_value(track_prop_dict, group_property, measure,
+                          executor=None):
+    """Group a track properties dict by the distinct values of some
+    property, then compute some measure for the tracks in each group.
+    This is take_measure_by_bin() for properties that take discrete
+    values, such as pdgid.
+
+    Args:
+        track_prop_dict: a track properties dict.
+        group_property: a property in track_prop_dict that will split
+            it into groups, one for each distinct value.
+        measure: a function that takes in a track properties dict and
+            returns a number and an error.
+        executor: a concurrent.futures executor on which to run the
+            measure for each group. See take_measure_by_bin().
+
+    Returns:
+        The sorted distinct values, and the measures and errors computed
+        for the tracks with each value.
+    """
+
+    values, track_indices, counts = unique(
+            asarray(track_prop_dict[group_property]),
+            return_inverse=True, return_counts=True)
+    track_order = argsort(track_indices.ravel(), kind="stable")
+    group_boundaries = [0] + list(cumsum(counts))
+    track_indices_by_value = list(map(lambda start, end:
+        track_order[start:end],
+        group_boundaries[:-1], group_boundaries[1:]))
+
+    heights, errs = _take_measure_by_bin_indices(track_prop_dict, measure,
+            track_indices_by_value, executor)
+
+    return list(values), heights, errs
+
+
+def _take_measure_by_bin_indices(track_prop_dict, measure,
+                                 track_indices_by_bin, executor=None):
+    """Takes a measure on the tracks of each bin, given as an array of
+    track indices per bin. Returns lists of the heights and errors. See
+    take_measure_by_bin() for the executor argument."""
+
+    # Convert each value list once rather than once per bin
+    track_prop_arrays = dict(map(lambda track_property, val_list:
+        (track_property, asarray(val_list)),
+        track_prop_dict.keys(), track_prop_dict.values()))
+
+    def take_binned_track_prop_dict(track_indices):
+        """Returns the track properties dict of only the given
+        tracks."""
+
+        return dict(map(lambda track_property, val_array:
+            (track_property, list(val_array[track_indices])),
+            track_prop_arrays.keys(), track_prop_arrays.values()))
+
+    if executor is None:
+        bin_heights_and_errs = list(map(lambda track_indices:
+            measure(take_binned_track_prop_dict(track_indices)),
+            track_indices_by_bin))
+    elif isinstance(executor, ProcessPoolExecutor):
+        bin_heights_and_errs = _take_measure_by_bin_in_processes(
+                track_prop_arrays, measure, track_indices_by_bin, executor)
+    else:
+        bin_heights_and_errs = list(map(lambda future: future.result(),
+            list(map(lambda track_indices:
+                executor.submit(measure,
+                    take_binned_track_prop_dict(track_indices)),
+                track_indices_by_bin))))
 
     bin_heights = list(map(lambda l: l[0], bin_heights_and_errs))
     bin_errs = list(map(lambda l: l[1], bin_heights_and_errs))
 
-    return bins, bin_heights, bin_errs
+    return bin_heights, bin_errs
+
+
+def _take_measure_by_bin_in_processes(track_prop_arrays, measure,
+                                      track_indices_by_bin, executor):
+    """Runs a measure on each bin in a process pool. Each numeric value
+    array is sorted by bin into a single shared memory block, so that
+    each task only carries the names of the blocks and the range of
+    positions belonging to its bin. Other value arrays are pickled bin
+    by bin. Returns the measure results in bin order."""
+
+    sorted_track_indices = concatenate(track_indices_by_bin)
+    bin_boundaries = [0] + list(cumsum(list(map(len, track_indices_by_bin))))
+
+    shared_memories = []
+    try:
+        shared_columns = {}
+        pickled_columns = {}
+        for track_property, val_array in track_prop_arrays.items():
+            sorted_val_array = val_array[sorted_track_indices]
+            if sorted_val_array.dtype.hasobject:
+                pickled_columns[track_property] = sorted_val_array
+                continue
+            shared_memory = SharedMemory(create=True,
+                    size=max(sorted_val_array.nbytes, 1))
+            shared_memories.append(shared_memory)
+            ndarray(sorted_val_array.shape, dtype=sorted_val_array.dtype,
+                    buffer=shared_memory.buf)[:] = sorted_val_array
+            shared_columns[track_property] = (shared_memory.name,
+                    sorted_val_array.dtype.str, len(sorted_val_array))
+
+        futures = list(map(lambda start, end:
+            executor.submit(_measure_shared_bin, measure, shared_columns,
+                dict(map(lambda track_property, sorted_val_array:
+                    (track_property, sorted_val_array[start:end]),
+                    pickled_columns.keys(), pickled_columns.values())),
+                start, end),
+            bin_boundaries[:-1], bin_boundaries[1:]))
+
+        return list(map(lambda future: future.result(), futures))
+    finally:
+        for shared_memory in shared_memories:
+            shared_memory.close()
+            shared_memory.unlink()
+
+
+def _measure_shared_bin(measure, shared_columns, pickled_columns, start, end):
+    """Worker half of _take_measure_by_bin_in_processes(). Rebuilds the
+    track properties dict of a single bin from shared memory and the
+    pickled value arrays, then takes the measure on it."""
+
+    track_prop_dict = dict(map(lambda track_property, sorted_val_array:
+        (track_property, list(sorted_val_array)),
+        pickled_columns.keys(), pickled_columns.values()))
+
+    for track_property, (name, dtype, length) in shared_columns.items():
+        shared_memory = SharedMemory(name=name)
+        try:
+            track_prop_dict[track_property] = list(ndarray((length,),
+                dtype=dtype, buffer=shared_memory.buf)[start:end].copy())
+        finally:
+            shared_memory.close()
+
+    return measure(track_prop_dict)
 
 
 def pred_error(domain_size, num_selected):
@@ -172,16 +695,175 @@ def eff_from_track_prop_dict(track_prop_dict_tp, selector_dict=None):
     Returns:
         A tuple containing the efficiency of the tracking algorithm for
         the tracks in the given ntuple dict and the standard deviation.
+        If no tracking particles are selected, returns (0, 0).
     """
 
-    if selector_dict is not None:
-        track_prop_dict_tps = ndops.cut_track_prop_dict(
-                track_prop_dict_tp, selector_dict)
+    if selector_dict is None:
+        selector_dict = {}
+
+    return next(iter(effs_from_track_prop_dict(
+        track_prop_dict_tp, [selector_dict])))
+
 
-    num_tps = ndops.track_prop_dict_length(track_prop_dict_tps)
-    num_matched_tps = num_tps - track_prop_dict_tps["nmatch"].count(0)
+def effs_from_track_prop_dict(track_prop_dict_tp, selector_dicts):
+    """Finds the efficiency with pred error of a track properties dict
+    for each of many selector dicts (working points) in one scan. Each
+    unique (property, selector) pair is evaluated only once, and the
+    matched and total tracking particle counts for every working point
+    are found together through reductions over a matrix of masks.
+
+    Args:
+        track_prop_dict_tp: a tracks properties dict carrying value
+            lists from tracking particles. Must contain nmatch.
+        selector_dicts: a list of dictionaries from tp properties
+            ("pt", "eta", etc.) to selectors (sel(0, 2), etc.).
+
+    Returns:
+        A list of tuples, one per selector dict in the same order,
+        containing the efficiency and its error. If a selector dict
+        selects no tracking particles, its tuple is (0, 0).
+    """
+
+    # Evaluate each unique (property, selector) pair only once
+    masks = {}
+    for selector_dict in selector_dicts:
+        for track_property, selector in selector_dict.items():
+            if track_property not in track_prop_dict_tp.keys():
+                warn("{} not in tracks properties; will not select"
+                        .format(track_property), UserWarning)
+                continue
+            mask_key = (track_property, id(selector))
+            if mask_key not in masks:
+                masks[mask_key] = ndops.val_list_mask(
+                        track_prop_dict_tp[track_property], selector)
+
+    # Build a matrix indexed by working point and track
+    num_tracks = ndops.track_prop_dict_length(track_prop_dict_tp)
+    selected = ones((len(selector_dicts), num_tracks), dtype=bool)
+    for row, selector_dict in zip(selected, selector_dicts):
+        for track_property, selector in selector_dict.items():
+            mask_key = (track_property, id(selector))
+            if mask_key in masks:
+                row &= masks[mask_key]
+
+    matched = ndops.val_list_mask(track_prop_dict_tp["nmatch"],
+            sel(0, invert=True))
+    num_tps = count_nonzero(selected, axis=1)
+    num_matched_tps = count_nonzero(selected & matched, axis=1)
+
+    return list(map(lambda num_tps, num_matched_tps:
+        (num_matched_tps / num_tps, pred_error(num_tps, num_matched_tps))
+            if num_tps else (0, 0),
+        num_tps.tolist(), num_matched_tps.tolist()))
+
+
+def effs_and_fake_rates_from_cut_list(ntuple_dict, cut_property, cuts,
+                                      cuts_constricting=True):
+    """Finds the efficiency and fake rate of an ntuple dict after each
+    of a list of cuts on one track property, as in a ROC scan. The cut
+    is applied to trk and matchtrk (and so, symmetrically, to matchtp
+    and tp) just like ntupledicts.operations.cut_ntuple_dict() would.
+    See counts_from_cut_list() for how this is done quickly.
+
+    Args:
+        ntuple_dict: an ntuple dict that contains trk with at least
+            genuine and the cut property, matchtrk with at least the
+            cut property, and tp with at least nmatch.
+        cut_property: the variable to change cuts on.
+        cuts: a list of length 2 lists containing lower and upper cut
+            bounds (inclusive).
+        cuts_constricting: if True, each cut is applied on top of all
+            the cuts before it, as when the cuts are in increasing order
+            of strictness. True by default.
+
+    Returns:
+        A list of efficiencies and a list of fake rates, each indexed by
+        cut. Where a cut leaves no tracks, the value is zero.
+    """
+
+    num_trks, num_fake_trks, num_tps, num_matched_tps = counts_from_cut_list(
+            ntuple_dict, cut_property, cuts, cuts_constricting)
+
+    def proportion(num_counted, num_tracks):
+        return num_counted / num_tracks if num_tracks else 0
+
+    return (list(map(proportion, num_matched_tps, num_tps)),
+            list(map(proportion, num_fake_trks, num_trks)))
+
+
+def counts_from_cut_list(ntuple_dict, cut_property, cuts,
+                         cuts_constricting=True):
+    """Counts the tracks, fake tracks, tracking particles, and matched
+    tracking particles left in an ntuple dict after each of a list of
+    cuts on one track property. Counts from different chunks of data
+    can be added together before finding efficiencies and fake rates.
+
+    Rather than cutting the ntuple dict once per cut, the trk and
+    matchtrk values of the cut property are each sorted once, and the
+    counts in any cut range are read off of prefix sums. A scan over
+    hundreds of cuts costs about as much as a single cut.
+
+    Args:
+        ntuple_dict: an ntuple dict that contains trk with at least
+            genuine and the cut property, matchtrk with at least the
+            cut property, and tp with at least nmatch.
+        cut_property: the variable to change cuts on.
+        cuts: a list of length 2 lists containing lower and upper cut
+            bounds (inclusive).
+        cuts_constricting: if True, each cut is applied on top of all
+            the cuts before it. True by default.
+
+    Returns:
+        Lists of the number of trks, fake trks, tps, and matched tps,
+        each indexed by cut.
+    """
 
-    return num_matched_tps / num_tps, pred_error(num_tps, num_matched_tps)
+    def make_cumulative_counter(val_list, counted_list):
+        """Sorts the values, and returns a function from a cut range to
+        the number of values in that range and the number of those for
+        which counted_list is True."""
+
+        val_array = asarray(val_list)
+        val_order = argsort(val_array, kind="stable")
+        sorted_vals = val_array[val_order]
+        cumulative_counted = concatenate([[0],
+            cumsum(asarray(counted_list)[val_order])])
+
+        def count_in_range(cut_range):
+            lower_index = searchsorted(sorted_vals, cut_range[0], side="left")
+            upper_index = max(lower_index,
+                    searchsorted(sorted_vals, cut_range[1], side="right"))
+            return (int(upper_index - lower_index),
+                    int(cumulative_counted[upper_index]
+                        - cumulative_counted[lower_index]))
+
+        return count_in_range
+
+    count_trks = make_cumulative_counter(ntuple_dict["trk"][cut_property],
+            ndops.val_list_mask(ntuple_dict["trk"]["genuine"], sel(0)))
+    count_tps = make_cumulative_counter(
+            ntuple_dict["matchtrk"][cut_property],
+            ndops.val_list_mask(ntuple_dict["tp"]["nmatch"],
+                sel(0, invert=True)))
+
+    # If cuts are constricting, the cut range is the overlap of all so far
+    cut_ranges = []
+    lower_bound, upper_bound = -inf, inf
+    for cut in cuts:
+        if cuts_constricting:
+            lower_bound = max(lower_bound, cut[0])
+            upper_bound = min(upper_bound, cut[1])
+        else:
+            lower_bound, upper_bound = cut[0], cut[1]
+        cut_ranges.append((lower_bound, upper_bound))
+
+    trk_counts = list(map(count_trks, cut_ranges))
+    tp_counts = list(map(count_tps, cut_ranges))
+
+    return (list(map(lambda l: l[0], trk_counts)),
+            list(map(lambda l: l[1], trk_counts)),
+            list(map(lambda l: l[0], tp_counts)),
+            list(map(lambda l: l[1], tp_counts)))
 
 
 class StubInfo(object):
@@ -1,7 +1,6 @@
 """LOAD: loads root files into ntuple dicts."""
 
 
-from uproot import open as uproot_open
 from . import operations as ndops
 from .operations import select as sel
 
@@ -34,6 +33,8 @@ def root_files_to_ntuple_dict(root_ntuple_paths, properties_by_track_type,
             files.
     """
 
+    from uproot import open as uproot_open
+
     # Extract uproot event trees
     uproot_ntuples = []
     for root_ntuple_path in root_ntuple_paths:
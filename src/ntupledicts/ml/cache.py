@@ -0,0 +1,262 @@
+"""CACHE: keep model predictions on disk so that repeated inference
+with the same model on the same data is free.
+
+Predictions are keyed on a digest of the model's learned state and of
+the data it predicts on, so retraining a model or changing the data
+always misses. The cache is bounded in size, evicting the least
+recently used predictions first. Errors reading or writing the cache
+are treated as misses and skipped writes, so the cache never stops a
+prediction.
+"""
+
+from hashlib import blake2b
+from os import environ
+from os import fdopen
+from os import listdir
+from os import makedirs
+from os import path
+from os import remove
+from os import replace
+from os import stat
+from os import utime
+from pickle import PicklingError
+from pickle import dumps
+from tempfile import mkstemp
+from warnings import warn
+from numpy import ascontiguousarray
+from numpy import asarray
+from numpy import load as npload
+from numpy import save as npsave
+
+
+_DEFAULT_CACHE_DIR = environ.get("NTUPLEDICTS_CACHE_DIR", path.join(
+    path.expanduser("~"), ".cache", "ntupledicts", "predictions"))
+_DEFAULT_MAX_BYTES = 2 ** 30
+
+
+class InferenceCache:
+    """A directory of prediction arrays, one .npy file per key, with
+    least-recently-used eviction once the files pass a total size.
+
+        cache = InferenceCache("/tmp/preds", max_bytes=10 ** 8)
+        key = cache.make_key(GBDT, data)
+        pred_labels = cache.get(key)  # None the first time
+        cache.put(key, ndmlpred.predict_labels(GBDT, data, use_cache=False))
+        cache.hits, cache.misses  # (0, 1)
+    """
+
+    def __init__(self, cache_dir, max_bytes=_DEFAULT_MAX_BYTES):
+        """Initializes this InferenceCache in a directory, created if
+        needed.
+
+        Args:
+            cache_dir: a path to a directory for the cached arrays.
+            max_bytes: the most bytes of predictions to keep.
+        """
+
+        makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, model, data, feature_spec=None):
+        """Returns the key for a model's predictions on some data.
+
+        Args:
+            model: a tensorflow or sklearn model.
+            data: an array or tensor of the data predicted on, or its
+                data_digest(), to avoid hashing it again for each model.
+            feature_spec: anything with a stable repr that describes
+                how features were taken from data, like the track
+                properties used, or None.
+
+        Returns:
+            A hex digest, or None if the model cannot be serialized.
+        """
+
+        model_digest = model_fingerprint(model)
+        if model_digest is None:
+            return None
+
+        key_hash = blake2b(digest_size=16)
+        key_hash.update(model_digest.encode())
+        key_hash.update((data if isinstance(data, str)
+                         else data_digest(data)).encode())
+        key_hash.update(repr(feature_spec).encode())
+
+        return key_hash.hexdigest()
+
+    def get(self, key):
+        """Returns the cached predictions under a key, or None, counting
+        a hit or a miss. A hit marks the predictions as recently used."""
+
+        if key is None:
+            self.misses += 1
+            return None
+
+        try:
+            pred_labels = npload(self._path(key))
+            utime(self._path(key))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pred_labels
+
+    def put(self, key, pred_labels):
+        """Stores predictions under a key, then evicts the least
+        recently used predictions until the cache fits its size. The
+        predictions are written to a temporary file of their own and
+        then moved into place, so concurrent writers never share a
+        file. If writing fails, nothing is stored."""
+
+        if key is None:
+            return
+
+        temp_path = None
+        try:
+            temp_fd, temp_path = mkstemp(suffix=".tmp.npy",
+                                         dir=self.cache_dir)
+            with fdopen(temp_fd, "wb") as temp_file:
+                npsave(temp_file, asarray(pred_labels))
+            replace(temp_path, self._path(key))
+            self._evict()
+        except OSError:
+            if temp_path is not None:
+                _remove_if_present(temp_path)
+
+    def clear(self):
+        """Removes every cached prediction and resets the counters."""
+
+        for file_path, _, _ in self._file_stats():
+            _remove_if_present(file_path)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Returns a dict of the hits, misses, number of cached
+        predictions, and bytes used."""
+
+        file_stats = self._file_stats()
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(file_stats),
+                "bytes": sum(map(lambda file_stat: file_stat[2],
+                                 file_stats))}
+
+    def _path(self, key):
+        return path.join(self.cache_dir, "{}.npy".format(key))
+
+    def _file_stats(self):
+        """Returns the path, modification time, and size of each cached
+        prediction file, skipping files removed while listing them."""
+
+        file_stats = []
+        for file_name in listdir(self.cache_dir):
+            if not file_name.endswith(".npy") \
+                    or file_name.endswith(".tmp.npy"):
+                continue
+            file_path = path.join(self.cache_dir, file_name)
+            try:
+                file_stat = stat(file_path)
+            except FileNotFoundError:
+                continue
+            file_stats.append((file_path, file_stat.st_mtime,
+                               file_stat.st_size))
+
+        return file_stats
+
+    def _evict(self):
+        """Removes the least recently used files until the total size
+        is within max_bytes."""
+
+        file_stats = sorted(self._file_stats(),
+                            key=lambda file_stat: file_stat[1])
+        total_bytes = sum(map(lambda file_stat: file_stat[2], file_stats))
+        for file_path, _, file_size in file_stats:
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= file_size
+            _remove_if_present(file_path)
+
+
+_inference_cache = None
+_inference_cache_enabled = True
+
+
+def get_inference_cache():
+    """Returns the InferenceCache used by ndmlpred by default, creating
+    it on first use in NTUPLEDICTS_CACHE_DIR, or in
+    ~/.cache/ntupledicts/predictions. Returns None if caching has been
+    turned off with set_inference_cache(None), or if that directory
+    can't be created, which warns once."""
+
+    global _inference_cache, _inference_cache_enabled
+    if _inference_cache is None and _inference_cache_enabled:
+        try:
+            _inference_cache = InferenceCache(_DEFAULT_CACHE_DIR)
+        except OSError as error:
+            warn("Cannot use {} for the inference cache, so predictions "
+                 "will not be cached: {}".format(_DEFAULT_CACHE_DIR, error),
+                 UserWarning)
+            _inference_cache_enabled = False
+
+    return _inference_cache
+
+
+def set_inference_cache(cache):
+    """Sets the InferenceCache used by ndmlpred by default. Pass None
+    to turn default caching off."""
+
+    global _inference_cache, _inference_cache_enabled
+    _inference_cache = cache
+    _inference_cache_enabled = cache is not None
+
+
+def _remove_if_present(file_path):
+    """Removes a file, unless another process already has."""
+
+    try:
+        remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def model_fingerprint(model):
+    """Returns a hex digest of a model's architecture and learned
+    state: a keras model's config and weights, or a pickled sklearn
+    model. Returns None for models that cannot be serialized."""
+
+    model_hash = blake2b(digest_size=16)
+    try:
+        if "keras" in str(type(model)):
+            model_hash.update(model.to_json().encode())
+            for weights in model.get_weights():
+                model_hash.update(_array_digest(weights))
+        else:
+            model_hash.update(dumps(model))
+    except (TypeError, AttributeError, ValueError, PicklingError,
+            NotImplementedError):
+        return None
+
+    return model_hash.hexdigest()
+
+
+def data_digest(data):
+    """Returns a hex digest of the data a model predicts on, usable in
+    place of the data in InferenceCache.make_key()."""
+
+    return _array_digest(data).hex()
+
+
+def _array_digest(data):
+    """Returns a digest of an array or tensor's dtype, shape, and
+    contents."""
+
+    data = ascontiguousarray(asarray(data))
+    array_hash = blake2b(digest_size=16)
+    array_hash.update(repr((data.dtype.str, data.shape)).encode())
+    array_hash.update(data.data)
+
+    return array_hash.digest()
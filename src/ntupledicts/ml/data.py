@@ -1,9 +1,34 @@
-from tensorflow import constant as tfconst
-from tensorflow import transpose as tftrans
-from tensorflow.keras.utils import normalize as tfnorm
-from tensorflow import float64
 from .. import operations as ndops
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from json import dump
+from json import load
+from os import makedirs
+from os import path
+from pickle import dumps
+from numpy import arange
+from numpy import argsort
+from numpy import ascontiguousarray
+from numpy import asarray
+from numpy import concatenate
+from numpy import count_nonzero
+from numpy import cumsum
+from numpy import empty
+from numpy import float32
+from numpy import int8
+from numpy import ones
+from numpy import sort
+from numpy import stack
+from numpy import unique
+from numpy import split as npsplit
+from numpy.random import default_rng
+from numpy import dtype as npdtype
+from numpy import load as npload
+from numpy import save as npsave
+
+
+_SHARD_NAME = "shard{:05d}"
+_SHARD_INFO_NAME = "shard_info.json"
 
 
 class TrackPropertiesDataset:
@@ -34,10 +59,15 @@ class TrackPropertiesDataset:
     This dataset can also store predictions, accept selector dicts to
     preform cuts, and be split into multiple datasets of the same form
     but of different size.
+
+    Value lists are stored as read-only numpy arrays, so that splits
+    and exported track properties dicts can share them rather than
+    copying them. To change values, copy the array first.
     """
 
     def __init__(self, track_prop_dict, label_property,
-                 active_data_properties=[], prediction_dict={}):
+                 active_data_properties=[], prediction_dict=None,
+                 max_vals=None):
         """Initializes this TrackPropertiesDataset with its track
         properties dict, its access settings, and predictions, if any.
 
@@ -49,17 +79,25 @@ class TrackPropertiesDataset:
                 available properties become active save for the label
                 property.
             prediction_dict: a dictionary from prediction names
-                (typically the name of the model) to prediction lists.
+                (typically the name of the model) to prediction lists,
+                a PredictionStore, or None.
+            max_vals: a dict from track properties to the values that
+                get_data() normalizes them by, or None. Properties not
+                in it are normalized by their own maximum value.
         """
 
         # Determine whether the given track properties dict is valid by using
         # the most basic function checking track properties dict validity
         ndops.track_prop_dict_length(track_prop_dict)
 
-        self._track_prop_dict = track_prop_dict
+        self._track_prop_dict = _freeze_track_prop_dict(track_prop_dict)
+        self.clear_data_cache()
         self.set_label_property(label_property)
         self.set_active_data_properties(active_data_properties)
-        self._predictions = prediction_dict
+        self._predictions = prediction_dict \
+            if isinstance(prediction_dict, PredictionStore) \
+            else PredictionStore(self.size(), prediction_dict)
+        self._max_vals = {} if max_vals is None else dict(max_vals)
 
     def __add__(self, other):
         """Add this TrackPropertiesDataset together with another.
@@ -92,24 +130,84 @@ class TrackPropertiesDataset:
             raise ValueError("Available prediction names do not match.")
 
         return TrackPropertiesDataset(
-            ndops.add_track_prop_dicts(
-                [self._track_prop_dict, other._track_prop_dict]),
+            _concatenate_track_prop_dicts(
+                self._track_prop_dict, other._track_prop_dict),
             self._label_property,
-            other.active_data_properties,
-            ndops.add_track_prop_dicts(
-                [self._predictions, other._predictions]))
+            self.get_active_data_properties(),
+            self._predictions.concatenate(other._predictions),
+            self._max_vals)
 
     def __eq__(self, other):
         """Determines whether two TrackPropertiesDatasets have the same
         active properties, label properties, available data, and
-        available predictions."""
+        available predictions, by comparing their fingerprints."""
 
         return isinstance(self, type(other)) and \
-               self.get_label_property() == other.get_label_property() and \
-               self.get_active_data_properties() \
-               == other.get_active_data_properties() and \
-               self.to_track_prop_dict(include_preds=True) \
-               == other.to_track_prop_dict(include_preds=True)
+               self.fingerprint() == other.fingerprint()
+
+    def fingerprint(self):
+        """Returns a hex digest of this dataset's contents: its label
+        property, active data properties, value lists, and predictions.
+
+        Each value list is hashed once, the first time it is needed,
+        as the arrays cannot change. Changing the settings or the
+        predictions only rehashes what changed, and otherwise this
+        returns a stored value.
+
+        Datasets themselves are unhashable, since their settings and
+        predictions can change. Use this as a cache key instead.
+
+        Normalization maximums that equal a value list's own maximum
+        are left out, as they don't change get_data(). So a dataset
+        reloaded with load_shards() has the fingerprint it was saved
+        with.
+        """
+
+        if self._fingerprint is None:
+            max_vals = dict(filter(lambda max_val_item:
+                max_val_item[0] not in self._track_prop_dict
+                or max_val_item[1] != self._column_max(max_val_item[0]),
+                self._max_vals.items()))
+            dataset_hash = blake2b(digest_size=16)
+            dataset_hash.update(repr((self.get_label_property(),
+                list(self.get_active_data_properties()),
+                sorted(max_vals.items()))).encode())
+            for column_key in sorted(
+                    list(map(lambda track_property: ("data", track_property),
+                             self._track_prop_dict))
+                    + list(map(lambda pred_name: ("pred", pred_name),
+                               self._predictions))):
+                dataset_hash.update(repr(column_key).encode())
+                dataset_hash.update(self._column_fingerprint(column_key))
+            self._fingerprint = dataset_hash.hexdigest()
+
+        return self._fingerprint
+
+    def _column_fingerprint(self, column_key):
+        """Returns the digest of the value list under a key of the form
+        ("data", track property) or ("pred", prediction name), hashing
+        it only if it has not been hashed before."""
+
+        if column_key not in self._column_fingerprints:
+            column_type, column_name = column_key
+            self._column_fingerprints[column_key] = _hash_val_list(
+                self._track_prop_dict[column_name] if column_type == "data"
+                else self._predictions[column_name])
+
+        return self._column_fingerprints[column_key]
+
+    def _column_max(self, track_property):
+        """Returns the maximum of a value list, the default that
+        get_data() normalizes it by, or None if it has no numeric
+        maximum."""
+
+        if track_property not in self._column_maxes:
+            val_list = self._track_prop_dict[track_property]
+            self._column_maxes[track_property] = None \
+                if val_list.dtype.hasobject \
+                else float(val_list.max()) if len(val_list) > 0 else 0
+
+        return self._column_maxes[track_property]
 
     def __ne__(self, other):
         """Returns whether two TrackPropertiesDatasets are unequal,
@@ -132,16 +230,25 @@ class TrackPropertiesDataset:
 
     # DATA
 
-    def get_data(self, track_properties=None, normalize=True):
+    def get_data(self, track_properties=None, normalize=True,
+                 dtype="float64", as_numpy=False):
         """Returns data corresponding to the given data properties as
-        a tensorflow array. By default, returns non-normalized active
-        data.
+        a tensorflow array. By default, returns normalized active data.
+
+        The feature matrix is built once per combination of properties,
+        normalization, and dtype and then cached, as is the tensor made
+        from it. The cache is cleared when the active data properties
+        change.
 
         Args:
             track_properties: a list of track properties. If None,
                 returns the active data.
             normalize: normalize the data within each track property.
-                False by default.
+                True by default.
+            dtype: the numpy dtype of the returned data.
+            as_numpy: if True, return the cached numpy array itself
+                rather than a tensor. It is read-only, as it is shared
+                between calls.
 
         Returns:
             A tensor array of this dataset's data. It is indexed on the
@@ -161,11 +268,48 @@ class TrackPropertiesDataset:
                     raise ValueError("Provided track property {} not available"
                                      "in this dataset.".format(track_property))
 
-        return tftrans(tfconst(list(map(lambda track_property:
-                    ndops.normalize_val_list(
-                        self._track_prop_dict[track_property]) if normalize\
-                                else self._track_prop_dict[track_property],
-                    track_properties)), dtype=float64))
+        data_key = (tuple(track_properties), normalize, npdtype(dtype).str)
+        if data_key not in self._data_cache:
+            self._data_cache[data_key] = self._make_data_matrix(
+                track_properties, normalize, dtype)
+        if as_numpy:
+            return self._data_cache[data_key]
+
+        if data_key not in self._tensor_cache:
+            from tensorflow import convert_to_tensor
+            self._tensor_cache[data_key] = convert_to_tensor(
+                self._data_cache[data_key])
+        return self._tensor_cache[data_key]
+
+    def _make_data_matrix(self, track_properties, normalize, dtype):
+        """Builds a read-only, C-contiguous matrix of the given track
+        properties, indexed by track and then by property."""
+
+        data_matrix = empty((self.size(), len(track_properties)), dtype=dtype)
+        for column, track_property in enumerate(track_properties):
+            val_array = asarray(self._track_prop_dict[track_property],
+                                dtype=dtype)
+            if normalize:
+                max_val = self._max_vals.get(track_property,
+                    val_array.max() if len(val_array) > 0 else 0)
+                data_matrix[:, column] = val_array / max_val if max_val != 0 \
+                    else 0
+            else:
+                data_matrix[:, column] = val_array
+        data_matrix.flags.writeable = False
+
+        return data_matrix
+
+    def clear_data_cache(self):
+        """Drops all cached feature matrices, tensors, and fingerprints.
+        Call this if an array this dataset was made from is changed in
+        place."""
+
+        self._data_cache = {}
+        self._tensor_cache = {}
+        self._column_fingerprints = {}
+        self._column_maxes = {}
+        self._fingerprint = None
 
     def get_active_data_properties(self):
         """Returns a list of the current active data properties in this
@@ -200,13 +344,62 @@ class TrackPropertiesDataset:
                 raise ValueError("Provided track property {} not available"
                                  "in this dataset.".format(track_property))
 
+        if track_properties != getattr(self, "_active_data_properties", None):
+            self._data_cache = {}
+            self._tensor_cache = {}
+            self._fingerprint = None
         self._active_data_properties = track_properties
 
+    def to_tf_dataset(self, batch_size=32, shuffle=True,
+                      track_properties=None, normalize=True,
+                      dtype="float32", seed=None):
+        """Returns a tf.data.Dataset of (data, label) batches, for
+        feeding models too large to train on as one tensor.
+
+        Rather than shuffling the tracks themselves, this shuffles
+        track indices each epoch and gathers whole batches from the
+        cached feature tensor in parallel, prefetching ahead of the
+        model.
+
+        Args:
+            batch_size: the number of tracks per batch.
+            shuffle: if True, reshuffle the tracks every epoch.
+            track_properties: a list of track properties. If None,
+                uses the active data.
+            normalize: normalize the data within each track property.
+            dtype: the dtype of the data and labels.
+            seed: a seed for the shuffle.
+
+        Returns:
+            A tf.data.Dataset yielding (data, labels) pairs.
+        """
+
+        from tensorflow import constant as tfconst
+        from tensorflow import gather as tfgather
+        from tensorflow.data import AUTOTUNE
+        from tensorflow.data import Dataset
+
+        data = self.get_data(track_properties, normalize, dtype)
+        labels = tfconst(asarray(
+            self._track_prop_dict[self._label_property], dtype=dtype))
+
+        indices = Dataset.range(self.size())
+        if shuffle:
+            indices = indices.shuffle(self.size(), seed=seed,
+                                      reshuffle_each_iteration=True)
+
+        return indices.batch(batch_size).map(
+            lambda batch_indices: (tfgather(data, batch_indices),
+                                   tfgather(labels, batch_indices)),
+            num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
     # LABELS
 
     def get_labels(self):
         """Return a tensor list of this dataset's labels."""
 
+        from tensorflow import constant as tfconst
+
         return tfconst(self._track_prop_dict[self._label_property])
 
     def get_label_property(self):
@@ -230,16 +423,15 @@ class TrackPropertiesDataset:
                              "not found in this dataset.")
 
         self._label_property = track_property
+        self._fingerprint = None
 
     # PREDICTIONS
 
     def get_all_predictions(self):
-        """Returns a dict from label names to lists of predicted
+        """Returns a dict from label names to arrays of predicted
         labels."""
 
-        return dict(map(lambda pred_name:
-                        (pred_name, self.get_prediction(pred_name)),
-                        self.get_all_prediction_names()))
+        return dict(self._predictions.items())
 
     def get_all_prediction_names(self):
         """Returns a list of names of all predictions in this
@@ -248,24 +440,40 @@ class TrackPropertiesDataset:
         return list(self._predictions.keys())
 
     def get_prediction(self, pred_name):
-        """Returns a list of predicted labels as a list.
+        """Returns predicted labels as a read-only float32 array.
 
         Args:
             pred_name: the name of a prediction.
 
         Returns:
-            A list of predicted labels.
+            An array of predicted labels.
 
         Raises:
             ValueError: if the given pred_name does not correspond to a
                 prediction in this TrackPropertiesDataset.
         """
 
-        if pred_name not in self.get_all_prediction_names():
-            raise ValueError("{} is not a prediction in this dataset."
-                             .format(pred_name))
+        return self._predictions.get(pred_name)
 
-        return self._predictions[pred_name]
+    def get_thresholded_prediction(self, pred_name, threshold):
+        """Returns a prediction with a threshold applied, as a read-only
+        array of ones and zeros. Each threshold of each prediction is
+        computed once and then reused.
+
+        Args:
+            pred_name: the name of a prediction.
+            threshold: predictions at or above this become one, and
+                those below become zero.
+
+        Returns:
+            An int8 array of predicted labels.
+
+        Raises:
+            ValueError: if the given pred_name does not correspond to a
+                prediction in this TrackPropertiesDataset.
+        """
+
+        return self._predictions.get_thresholded(pred_name, threshold)
 
     def add_prediction(self, pred_name, pred_labels):
         """Adds a list of predictions to this model accessible by a
@@ -276,20 +484,24 @@ class TrackPropertiesDataset:
             pred_name: a name by which to reference these predictions.
             pred_labels: the predicted labels. They can be probablistic
                 or one hot, but some plotting functionality will only
-                work for probablistic predictions.
-        """
+                work for probablistic predictions. They are stored as
+                float32.
 
-        if len(pred_labels) != self.size():
-            raise ValueError("Given prediction list has different number of "
-                             "elements ({}) than the number in this dataset ({})"
-                             .format(len(pred_labels), len(self.size())))
+        Raises:
+            ValueError: if there are not as many predicted labels as
+                tracks in this dataset.
+        """
 
-        self._predictions.update({pred_name: pred_labels})
+        self._predictions.add(pred_name, pred_labels)
+        self._column_fingerprints.pop(("pred", pred_name), None)
+        self._fingerprint = None
 
     def remove_prediction(self, pred_name):
         """Removes a prediction from this dataset's prediction dict."""
 
-        self._predictions.pop(pred_name)
+        self._predictions.remove(pred_name)
+        self._column_fingerprints.pop(("pred", pred_name), None)
+        self._fingerprint = None
 
     # CUTS
 
@@ -301,18 +513,15 @@ class TrackPropertiesDataset:
             selector_dict: a track property dict selector.
 
         Returns:
-            A cut TrackPropertiesDataset.
+            A cut TrackPropertiesDataset. Each of its value lists is
+            gathered from this dataset's in one pass.
         """
 
-        indices_to_cut = ndops.select_indices(
-            self._track_prop_dict, selector_dict)
-        return TrackPropertiesDataset(
-            ndops.cut_track_prop_dict_by_indices(
-                self._track_prop_dict, indices_to_cut),
-            self.get_label_property(),
-            self.get_active_data_properties(),
-            ndops.cut_track_prop_dict_by_indices(
-                self._predictions, indices_to_cut))
+        tracks_to_keep = ones(self.size(), dtype=bool)
+        tracks_to_keep[ndops.select_indices(
+            self._track_prop_dict, selector_dict)] = False
+
+        return self.take(tracks_to_keep)
 
     def split(self, split_list):
         """Returns datasets of number and relative sizes of elements as
@@ -326,40 +535,621 @@ class TrackPropertiesDataset:
                 same output.
 
         Returns:
-            A list of TrackPropertiesDatasets.
+            A list of TrackPropertiesDatasets. These share their value
+            lists with this dataset rather than copying them.
         """
 
         split_tpds = ndops.split_track_prop_dict(self._track_prop_dict,
                                                  split_list)
 
-        split_preds = ndops.split_track_prop_dict(self._predictions,
-                                                  split_list)
+        split_boundaries = [0] + list(cumsum(ndops.get_split_sizes(
+            split_list, self.size())))
+        split_preds = list(map(self._predictions.slice,
+                               split_boundaries[:-1], split_boundaries[1:]))
 
         return list(map(lambda split_tpd, split_preds:
                         TrackPropertiesDataset(split_tpd,
                                                self.get_label_property(),
                                                self.get_active_data_properties(),
-                                               split_preds),
+                                               split_preds,
+                                               self._max_vals),
                         split_tpds, split_preds))
 
+    def split_indices(self, split_list, shuffle=False, stratify=False,
+                      seed=None):
+        """Returns arrays of track indices that split this dataset into
+        parts of the relative sizes in split_list, without making any
+        new datasets. Pass an array to take() to get its dataset.
+
+        Args:
+            split_list: a list of relative sizes of the parts.
+            shuffle: if True, assign tracks to parts at random rather
+                than in order.
+            stratify: if True, split the tracks with each label value
+                separately, so that every part has the same proportion
+                of each label as the whole.
+            seed: a seed for the shuffle, or a numpy Generator.
+
+        Returns:
+            A list of sorted arrays of track indices, one per part.
+            Within each label value when stratifying, or overall when
+            not, the tracks left over from the parts' whole shares go
+            one each to the parts in turn, so that labels rarer than
+            the number of parts are spread out rather than all landing
+            in the last part.
+        """
+
+        rng = default_rng(seed)
+
+        if stratify:
+            _, label_inverse, label_counts = unique(
+                self._track_prop_dict[self._label_property],
+                return_inverse=True, return_counts=True)
+            index_groups = npsplit(argsort(label_inverse, kind="stable"),
+                                   cumsum(label_counts)[:-1])
+        else:
+            index_groups = [arange(self.size())]
+
+        # Each group's leftover tracks start at the part after the
+        # last one the previous group's leftovers went to
+        parts_by_group = []
+        first_part = 0
+        for index_group in index_groups:
+            if shuffle:
+                index_group = rng.permutation(index_group)
+            split_sizes, first_part = _spread_split_sizes(
+                split_list, len(index_group), first_part)
+            parts_by_group.append(npsplit(index_group,
+                                          cumsum(split_sizes)[:-1]))
+
+        return list(map(lambda part_num: sort(concatenate(list(map(
+            lambda parts: parts[part_num], parts_by_group)))),
+            range(len(split_list))))
+
+    def kfold_indices(self, k, shuffle=True, stratify=False, seed=None):
+        """Yields (train indices, test indices) pairs for k-fold cross
+        validation. Each track is in exactly one test set.
+
+        Folds are generated one at a time from a single assignment of
+        tracks to folds, so memory use does not grow with k. The pairs
+        can be passed straight to sklearn as a cv argument alongside
+        get_data(as_numpy=True).
+
+        Args:
+            k: the number of folds.
+            shuffle: if True, assign tracks to folds at random.
+            stratify: if True, give each fold the same proportion of
+                each label value.
+            seed: a seed for the shuffle, or a numpy Generator.
+
+        Yields:
+            Pairs of sorted arrays of track indices.
+        """
+
+        folds = self.split_indices([1] * k, shuffle, stratify, seed)
+        for test_fold_num, test_indices in enumerate(folds):
+            yield concatenate(folds[:test_fold_num]
+                              + folds[test_fold_num + 1:]), test_indices
+
+    def kfold(self, k, shuffle=True, stratify=False, seed=None):
+        """Yields (train dataset, test dataset) pairs for k-fold cross
+        validation. Only the pair in use is held in memory. See
+        kfold_indices() for the arguments."""
+
+        for train_indices, test_indices in self.kfold_indices(
+                k, shuffle, stratify, seed):
+            yield self.take(train_indices), self.take(test_indices)
+
+    def repeated_split_indices(self, split_list, repeats, stratify=False,
+                               seed=None):
+        """Yields repeated random splits as lists of track index arrays,
+        as in split_indices() with shuffling. Each repeat draws a new
+        shuffle from one seeded generator."""
+
+        rng = default_rng(seed)
+        for _ in range(repeats):
+            yield self.split_indices(split_list, True, stratify, rng)
+
+    def take(self, track_indices):
+        """Returns a TrackPropertiesDataset with the same settings as
+        this one, but with only the tracks at the given indices or
+        boolean mask."""
+
+        return TrackPropertiesDataset(
+            dict(map(lambda track_property: (track_property,
+                     self._track_prop_dict[track_property][track_indices]),
+                     self._track_prop_dict)),
+            self.get_label_property(),
+            self.get_active_data_properties(),
+            self._predictions.take(track_indices),
+            self._max_vals)
+
     # OTHER
 
-    def to_track_prop_dict(self, include_preds=False):
+    def to_track_prop_dict(self, include_preds=False, copy=True):
         """Converts this TrackPropertiesDataset to a track properties
         dict, with or without labeled predictions. Includes all
         available track properties, not just active data properties.
 
         Args:
             include_preds: if True, include predictions in the returned
-            track properties dict.
+                track properties dict.
+            copy: if True, return value lists as independent Python
+                lists. If False, return the read-only arrays held by
+                this dataset instead, which is free.
 
         Returns:
             A track properties dict.
         """
 
+        tpd_to_return = dict(self._track_prop_dict)
         if include_preds:
-            tpd_to_return = deepcopy(self._track_prop_dict)
-            tpd_to_return.update(deepcopy(self._predictions))
-            return tpd_to_return
-        else:
-            return deepcopy(self._track_prop_dict)
+            tpd_to_return.update(self._predictions)
+
+        if copy:
+            return dict(map(lambda track_property: (track_property,
+                            tpd_to_return[track_property].tolist()),
+                            tpd_to_return))
+        return tpd_to_return
+
+    def save_shards(self, shard_dir, shard_size=1000000):
+        """Saves this dataset to a directory as fixed-size shards of
+        .npy files, one per value list and prediction, along with its
+        settings and the maximum value of each property over all
+        tracks. Reopen it with load_shards().
+
+        Args:
+            shard_dir: a path to a directory, created if needed.
+            shard_size: the number of tracks in each shard. The last
+                shard holds the remainder.
+
+        Raises:
+            ValueError: if this dataset has no tracks, or if a value
+                list holds objects rather than numbers, which cannot be
+                memory mapped.
+        """
+
+        if self.size() == 0:
+            raise ValueError("Cannot save a dataset with no tracks as "
+                             "shards.")
+
+        columns = self.to_track_prop_dict(include_preds=True, copy=False)
+        for column_name, val_list in columns.items():
+            if val_list.dtype.hasobject:
+                raise ValueError("Value list {} holds objects, so cannot be "
+                                 "sharded.".format(column_name))
+
+        shard_bounds = list(range(0, self.size(), shard_size)) + [self.size()]
+        for shard_num, (start, end) in enumerate(zip(shard_bounds[:-1],
+                                                     shard_bounds[1:])):
+            for column_type, column_dict in (("data", self._track_prop_dict),
+                                             ("pred", self._predictions)):
+                column_dir = path.join(shard_dir, _SHARD_NAME.format(shard_num),
+                                       column_type)
+                makedirs(column_dir, exist_ok=True)
+                for column_name, val_list in column_dict.items():
+                    npsave(path.join(column_dir, column_name + ".npy"),
+                           val_list[start:end])
+
+        max_vals = dict(map(lambda track_property: (track_property,
+            float(self._max_vals.get(track_property,
+                self._track_prop_dict[track_property].max()
+                if self.size() > 0 else 0))),
+            self.get_available_data_properties()))
+        with open(path.join(shard_dir, _SHARD_INFO_NAME), "w") as info_file:
+            dump({"label_property": self.get_label_property(),
+                  "active_data_properties":
+                      list(self.get_active_data_properties()),
+                  "data_properties": self.get_available_data_properties(),
+                  "pred_names": self.get_all_prediction_names(),
+                  "shard_sizes": list(map(lambda start, end: end - start,
+                                          shard_bounds[:-1],
+                                          shard_bounds[1:])),
+                  "max_vals": max_vals}, info_file, indent=2)
+
+
+class PredictionStore:
+    """Named predictions over the tracks of one dataset, each held as a
+    read-only float32 array. Thresholded predictions are cached by
+    prediction name and threshold, and these caches follow the
+    predictions when they are sliced, so that applying a threshold to a
+    split of a dataset is free once it has been applied to the whole.
+
+    It reads like a dict from prediction names to arrays:
+
+        preds = PredictionStore(3, {"NN": [.2, .7, .9]})
+        list(preds.keys())  # ["NN"]
+        preds["NN"]  # array([.2, .7, .9], dtype=float32)
+        preds.get_thresholded("NN", .5)  # array([0, 1, 1], dtype=int8)
+    """
+
+    def __init__(self, num_tracks, prediction_dict=None):
+        """Initializes this PredictionStore for a number of tracks with
+        the predictions in prediction_dict, if any.
+
+        Args:
+            num_tracks: the number of tracks each prediction is for.
+            prediction_dict: a dict from prediction names to lists of
+                predicted labels, or None.
+
+        Raises:
+            ValueError: if a prediction has a different number of
+                predicted labels than num_tracks.
+        """
+
+        self._num_tracks = num_tracks
+        self._preds = {}
+        self._thresholded_preds = {}
+        if prediction_dict is not None:
+            for pred_name, pred_labels in prediction_dict.items():
+                self.add(pred_name, pred_labels)
+
+    def __getitem__(self, pred_name):
+        return self._preds[pred_name]
+
+    def __iter__(self):
+        return iter(self._preds)
+
+    def __len__(self):
+        return len(self._preds)
+
+    def __contains__(self, pred_name):
+        return pred_name in self._preds
+
+    def keys(self):
+        return self._preds.keys()
+
+    def items(self):
+        return self._preds.items()
+
+    def get(self, pred_name):
+        """Returns the array of a prediction, raising a ValueError if
+        there is no prediction by that name."""
+
+        if pred_name not in self._preds:
+            raise ValueError("{} is not a prediction in this dataset."
+                             .format(pred_name))
+
+        return self._preds[pred_name]
+
+    def get_thresholded(self, pred_name, threshold):
+        """Returns a read-only int8 array that is one where the given
+        prediction is at or above the threshold and zero below it,
+        computing it only the first time it is asked for."""
+
+        threshold_key = (pred_name, threshold)
+        if threshold_key not in self._thresholded_preds:
+            self._thresholded_preds[threshold_key] = _freeze(
+                (self.get(pred_name) >= threshold).astype(int8))
+
+        return self._thresholded_preds[threshold_key]
+
+    def add(self, pred_name, pred_labels):
+        """Adds or replaces a prediction, storing it as float32.
+
+        Raises:
+            ValueError: if the prediction has a different number of
+                predicted labels than this store has tracks.
+        """
+
+        if len(pred_labels) != self._num_tracks:
+            raise ValueError("Given prediction list has different number of "
+                             "elements ({}) than the number in this dataset ({})"
+                             .format(len(pred_labels), self._num_tracks))
+
+        self._drop_thresholded(pred_name)
+        self._preds[pred_name] = _freeze(asarray(pred_labels, dtype=float32))
+
+    def remove(self, pred_name):
+        """Removes a prediction and its cached thresholds."""
+
+        self._drop_thresholded(pred_name)
+        self._preds.pop(pred_name)
+
+    def _drop_thresholded(self, pred_name):
+        """Forgets every cached threshold of a prediction."""
+
+        self._thresholded_preds = dict(filter(
+            lambda threshold_item: threshold_item[0][0] != pred_name,
+            self._thresholded_preds.items()))
+
+    def slice(self, start, end):
+        """Returns a PredictionStore of the tracks from start up to end,
+        sharing this store's arrays and cached thresholds."""
+
+        return self._derive(end - start,
+                            lambda val_list: val_list[start:end])
+
+    def take(self, track_indices):
+        """Returns a PredictionStore of only the tracks at the given
+        indices or boolean mask, carrying over cached thresholds."""
+
+        track_indices = asarray(track_indices)
+        num_tracks = count_nonzero(track_indices) \
+            if track_indices.dtype == bool else len(track_indices)
+
+        return self._derive(num_tracks,
+                            lambda val_list: val_list[track_indices])
+
+    def concatenate(self, other):
+        """Returns a PredictionStore of this store's tracks followed by
+        another's, which must have the same prediction names."""
+
+        if set(self.keys()) != set(other.keys()):
+            raise ValueError("Available prediction names do not match.")
+
+        pred_store = PredictionStore(self._num_tracks + other._num_tracks)
+        pred_store._preds = dict(map(lambda pred_name: (pred_name, _freeze(
+            concatenate([self._preds[pred_name], other._preds[pred_name]]))),
+            self._preds))
+
+        return pred_store
+
+    def _derive(self, num_tracks, select_tracks):
+        """Returns a PredictionStore holding select_tracks applied to
+        each of this store's predictions and cached thresholds."""
+
+        pred_store = PredictionStore(num_tracks)
+        pred_store._preds = dict(map(lambda pred_name: (pred_name,
+            _freeze(select_tracks(self._preds[pred_name]))), self._preds))
+        pred_store._thresholded_preds = dict(map(lambda threshold_key:
+            (threshold_key, _freeze(select_tracks(
+                self._thresholded_preds[threshold_key]))),
+            self._thresholded_preds))
+
+        return pred_store
+
+
+def _spread_split_sizes(split_list, num_tracks, first_part):
+    """Returns the sizes of the parts that split some tracks by the
+    relative sizes in split_list, and the part after the last one given
+    a leftover track. Each part gets its whole share of tracks, and the
+    leftover tracks go one each to the parts in turn, starting from
+    first_part."""
+
+    split_list_total = sum(split_list)
+    split_sizes = list(map(lambda split_val:
+        int(split_val * num_tracks / split_list_total), split_list))
+    num_leftovers = num_tracks - sum(split_sizes)
+    for leftover_num in range(num_leftovers):
+        split_sizes[(first_part + leftover_num) % len(split_sizes)] += 1
+
+    return split_sizes, (first_part + num_leftovers) % len(split_sizes)
+
+
+def _freeze(val_list):
+    """Returns a read-only numpy array of a value list, without copying
+    it if it is already a numpy array. Values that numpy cannot stack,
+    like lists of differing lengths, are kept as objects."""
+
+    try:
+        frozen_val_list = asarray(val_list).view()
+    except ValueError:
+        frozen_val_list = empty(len(val_list), dtype=object)
+        frozen_val_list[:] = val_list
+    frozen_val_list.flags.writeable = False
+
+    return frozen_val_list
+
+
+def _freeze_track_prop_dict(track_prop_dict):
+    """Returns a new track properties dict with each value list made a
+    read-only numpy array."""
+
+    return dict(map(lambda track_property:
+                    (track_property, _freeze(track_prop_dict[track_property])),
+                    track_prop_dict))
+
+
+def _hash_val_list(val_list):
+    """Returns a digest of a numpy value list's dtype, shape, and
+    contents, hashing numeric buffers directly."""
+
+    val_list_hash = blake2b(digest_size=16)
+    val_list_hash.update(repr((val_list.dtype.str, val_list.shape)).encode())
+    val_list_hash.update(dumps(val_list.tolist()) if val_list.dtype.hasobject
+                         else ascontiguousarray(val_list).data)
+
+    return val_list_hash.digest()
+
+
+def _concatenate_track_prop_dicts(track_prop_dict, other_track_prop_dict):
+    """Concatenates the value lists of two track properties dicts with
+    the same properties."""
+
+    return dict(map(lambda track_property: (track_property, concatenate(
+                    [track_prop_dict[track_property],
+                     other_track_prop_dict[track_property]])),
+                    track_prop_dict))
+
+
+def make_tf_dataset_from_chunks(make_chunks, data_properties, label_property,
+                                batch_size=32, shuffle_buffer_size=10000,
+                                max_vals=None, dtype="float32", seed=None):
+    """Returns a tf.data.Dataset of (data, label) batches read one chunk
+    at a time, for training on more tracks than fit in memory.
+
+    Chunks are read lazily each epoch, normalized in parallel, and
+    shuffled through a buffer of fixed size before batching. Since no
+    single chunk sees the whole sample, normalization must use maximum
+    values given up front.
+
+        tfds = make_tf_dataset_from_chunks(
+            lambda: map(lambda path: ndload.root_files_to_ntuple_dict(
+                [path], {"trk": props})["trk"], root_paths),
+            ["pt", "chi2"], "genuine", max_vals={"pt": 100, "chi2": 50})
+
+    Args:
+        make_chunks: a function taking no arguments that returns an
+            iterable of track properties dicts, such as one per ntuple
+            file. It is called once per epoch.
+        data_properties: a list of track properties to use as data.
+        label_property: the track property to use as the label.
+        batch_size: the number of tracks per batch.
+        shuffle_buffer_size: the number of tracks to shuffle between,
+            or None to not shuffle.
+        max_vals: a dict from data properties to the values to divide
+            them by, or None to leave the data unnormalized.
+        dtype: the dtype of the data and labels.
+        seed: a seed for the shuffle.
+
+    Returns:
+        A tf.data.Dataset yielding (data, labels) pairs.
+    """
+
+    from tensorflow import TensorSpec
+    from tensorflow import constant as tfconst
+    from tensorflow.data import AUTOTUNE
+    from tensorflow.data import Dataset
+
+    def generate_chunks():
+        for track_prop_dict in make_chunks():
+            yield (stack(list(map(lambda track_property:
+                                  asarray(track_prop_dict[track_property],
+                                          dtype=dtype),
+                                  data_properties)), axis=1),
+                   asarray(track_prop_dict[label_property], dtype=dtype))
+
+    tfds = Dataset.from_generator(generate_chunks, output_signature=(
+        TensorSpec(shape=(None, len(data_properties)), dtype=dtype),
+        TensorSpec(shape=(None,), dtype=dtype)))
+
+    if max_vals is not None:
+        scales = tfconst(list(map(lambda track_property:
+                                  1 / max_vals[track_property]
+                                  if max_vals[track_property] != 0 else 0,
+                                  data_properties)), dtype=dtype)
+        tfds = tfds.map(lambda data, labels: (data * scales, labels),
+                        num_parallel_calls=AUTOTUNE)
+
+    tfds = tfds.unbatch()
+    if shuffle_buffer_size is not None:
+        tfds = tfds.shuffle(shuffle_buffer_size, seed=seed)
+
+    return tfds.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def load_shards(shard_dir, shard_nums=None, mmap=True):
+    """Opens a dataset saved with TrackPropertiesDataset.save_shards().
+
+    A single shard opens as memory-mapped arrays, so nothing is read
+    until it is used. Several shards are read in parallel and joined.
+    Either way, get_data() normalizes by the maximum values over the
+    whole saved dataset, not just the shards loaded.
+
+    Args:
+        shard_dir: the directory the dataset was saved to.
+        shard_nums: a list of the shards to load, or None for all of
+            them.
+        mmap: if True, memory map the shard files rather than reading
+            them.
+
+    Returns:
+        A TrackPropertiesDataset.
+
+    Raises:
+        ValueError: if no shards are chosen.
+    """
+
+    shard_info = read_shard_info(shard_dir)
+    if shard_nums is None:
+        shard_nums = list(range(len(shard_info["shard_sizes"])))
+    if len(shard_nums) == 0:
+        raise ValueError("No shards to load from {}.".format(shard_dir))
+
+    def load_column(column_type, column_name):
+        """Loads one value list or prediction from all chosen shards."""
+
+        shard_val_lists = list(map(lambda shard_num: npload(
+            path.join(shard_dir, _SHARD_NAME.format(shard_num), column_type,
+                      column_name + ".npy"),
+            mmap_mode="r" if mmap else None), shard_nums))
+
+        return shard_val_lists[0] if len(shard_val_lists) == 1 \
+            else concatenate(shard_val_lists)
+
+    column_keys = list(map(lambda track_property: ("data", track_property),
+                           shard_info["data_properties"])) \
+        + list(map(lambda pred_name: ("pred", pred_name),
+                   shard_info["pred_names"]))
+    with ThreadPoolExecutor() as executor:
+        columns = dict(zip(column_keys, executor.map(
+            lambda column_key: load_column(*column_key), column_keys)))
+
+    return TrackPropertiesDataset(
+        dict(map(lambda track_property:
+                 (track_property, columns[("data", track_property)]),
+                 shard_info["data_properties"])),
+        shard_info["label_property"],
+        shard_info["active_data_properties"],
+        dict(map(lambda pred_name: (pred_name, columns[("pred", pred_name)]),
+                 shard_info["pred_names"])),
+        shard_info["max_vals"])
+
+
+def read_shard_info(shard_dir):
+    """Returns the settings, shard sizes, and maximum property values
+    of a dataset saved with TrackPropertiesDataset.save_shards()."""
+
+    with open(path.join(shard_dir, _SHARD_INFO_NAME)) as info_file:
+        return load(info_file)
+
+
+def make_tf_dataset_from_shards(shard_dir, batch_size=32,
+                                shuffle_buffer_size=10000, track_properties=None,
+                                normalize=True, dtype="float32", seed=None):
+    """Returns a tf.data.Dataset of (data, label) batches read from a
+    dataset saved with TrackPropertiesDataset.save_shards().
+
+    Shards are visited in a shuffled order each epoch and read several
+    at a time in parallel, each from its memory map, before their
+    tracks are shuffled through a buffer and batched.
+
+    Args:
+        shard_dir: the directory the dataset was saved to.
+        batch_size: the number of tracks per batch.
+        shuffle_buffer_size: the number of tracks to shuffle between,
+            or None to read tracks in order.
+        track_properties: a list of track properties to use as data. If
+            None, uses the saved active data properties.
+        normalize: normalize the data by the saved maximum values.
+        dtype: the dtype of the data and labels.
+        seed: a seed for the shuffles.
+
+    Returns:
+        A tf.data.Dataset yielding (data, labels) pairs.
+    """
+
+    from tensorflow import TensorSpec
+    from tensorflow.data import AUTOTUNE
+    from tensorflow.data import Dataset
+
+    shard_info = read_shard_info(shard_dir)
+    if track_properties is None:
+        track_properties = shard_info["active_data_properties"]
+    label_property = shard_info["label_property"]
+
+    def read_shard(shard_num):
+        """Yields a shard's data matrix and labels as one element."""
+
+        shard = load_shards(shard_dir, [int(shard_num)])
+        yield shard.get_data(track_properties, normalize, dtype,
+                             as_numpy=True), asarray(
+            shard.to_track_prop_dict(copy=False)[label_property],
+            dtype=dtype)
+
+    shard_nums = Dataset.range(len(shard_info["shard_sizes"]))
+    if shuffle_buffer_size is not None:
+        shard_nums = shard_nums.shuffle(len(shard_info["shard_sizes"]),
+                                        seed=seed)
+
+    tfds = shard_nums.interleave(
+        lambda shard_num: Dataset.from_generator(
+            read_shard, args=(shard_num,), output_signature=(
+                TensorSpec(shape=(None, len(track_properties)), dtype=dtype),
+                TensorSpec(shape=(None,), dtype=dtype))),
+        num_parallel_calls=AUTOTUNE, deterministic=False).unbatch()
+    if shuffle_buffer_size is not None:
+        tfds = tfds.shuffle(shuffle_buffer_size, seed=seed)
+
+    return tfds.batch(batch_size).prefetch(AUTOTUNE)
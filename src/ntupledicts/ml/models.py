@@ -1,37 +1,77 @@
-from tensorflow.keras import Sequential
-from tensorflow.keras.layers import Dense
-from sklearn.ensemble import GradientBoostingClassifier
+"""MODELS: make and train common models on TrackPropertiesDatasets.
+
+TensorFlow and sklearn are imported by the functions that use them
+rather than at the top of this module, as importing them takes seconds.
+"""
+
+from warnings import warn
 
 
 def make_neuralnet(train_dataset, eval_dataset=None,
-                   hidden_layers=[], epochs=10, classifier_order=1):
+                   hidden_layers=[], epochs=10, classifier_order=1,
+                   batch_size=32, early_stopping_patience=None,
+                   checkpoint_dir=None, num_threads=None, verbose=True):
     """Makes a neural net in tensorflow using training data and optional
     validation data. Takes in the dimension of the data, has the number
     of specified hidden layers, and ends with probablistic output.
 
+    Training runs over shuffled, prefetched batches from tf.data. Each
+    epoch's throughput in tracks per second is logged as
+    "tracks_per_second" alongside the loss, both in the progress output
+    and in the returned model's history.
+
     Args:
         train_dataset: a TrackPropertiesDataset that the model will
-            train on.
-        eval_dataset: a TrackPropertiesDataset that the model will
-            use to evalutate performance at the end of each epoch.
+            train on, or a batched tf.data.Dataset of (data, labels),
+            such as from make_tf_dataset_from_chunks.
+        eval_dataset: a TrackPropertiesDataset or tf.data.Dataset that
+            the model will use to evalutate performance at the end of
+            each epoch.
         hidden_layers: a list of hidden layer sizes. By default, there
             are no hidden layers, just the input and the output, which
             are predetermined by data dimension.
         epochs: how many time the neural net is trained on data.
         classifier_order: order of categorization. This is set to 1 at
             default, assuming a binary classifier.
+        batch_size: the number of tracks per training step. Ignored if
+            train_dataset is already a tf.data.Dataset.
+        early_stopping_patience: if given along with eval_dataset, stop
+            once the loss on eval_dataset has not improved for this
+            many epochs, and keep the best weights.
+        checkpoint_dir: a directory to save the training state to at
+            the end of every epoch. If a run is interrupted, calling
+            this again with the same directory resumes it from the last
+            finished epoch. The state is removed when training ends.
+        num_threads: the number of CPU threads tensorflow uses within
+            and across operations. Only takes effect before tensorflow
+            has run anything; otherwise a warning is raised.
+        verbose: if True, print progress each epoch.
 
     Returns:
         A trained tensorflow neural net.
     """
 
+    from tensorflow.keras import Input
+    from tensorflow.keras import Sequential
+    from tensorflow.keras.callbacks import BackupAndRestore
+    from tensorflow.keras.callbacks import EarlyStopping
+    from tensorflow.keras.layers import Dense
+
+    if num_threads is not None:
+        _set_tf_threads(num_threads)
+
+    train_tfds = _tf_dataset(train_dataset, batch_size)
+    if hasattr(train_dataset, "size"):
+        num_tracks = train_dataset.size()
+    else:
+        train_tfds, num_tracks = _count_tracks(train_tfds)
+
     # Build the scaffolding
     linear_model = Sequential()
-    hidden_layer_sizes = iter(hidden_layers)
-    linear_model.add(Dense(next(hidden_layer_sizes),
-                           input_dim=train_dataset.get_data_dim()))
-    for layer_size in hidden_layer_sizes:
-        linear_model.add(Dense(layer_size, activation="relu"))
+    linear_model.add(Input(shape=(train_tfds.element_spec[0].shape[-1],)))
+    for layer_num, layer_size in enumerate(hidden_layers):
+        linear_model.add(Dense(layer_size,
+                               activation=None if layer_num == 0 else "relu"))
     linear_model.add(Dense(classifier_order, activation="sigmoid"))
 
     # Compile
@@ -39,38 +79,187 @@ def make_neuralnet(train_dataset, eval_dataset=None,
                          optimizer='adam',
                          metrics=['accuracy'])
 
-    # Train loop
-    steps_per_epoch = train_dataset.size() / epochs
+    # Train loop, fed batch by batch through tf.data
     validation_data = None if eval_dataset is None \
-        else (eval_dataset.get_data(), eval_dataset.get_labels())
-    linear_model.fit(train_dataset.get_data(), train_dataset.get_labels(),
+        else _tf_dataset(eval_dataset, batch_size, shuffle=False)
+    callbacks = [_throughput_callback(num_tracks)]
+    if early_stopping_patience is not None and validation_data is not None:
+        callbacks.append(EarlyStopping(monitor="val_loss",
+                                       patience=early_stopping_patience,
+                                       restore_best_weights=True))
+    if checkpoint_dir is not None:
+        callbacks.append(BackupAndRestore(checkpoint_dir))
+    linear_model.fit(train_tfds,
                      validation_data=validation_data,
-                     steps_per_epoch=steps_per_epoch,
                      epochs=epochs,
-                     verbose=True)
+                     callbacks=callbacks,
+                     shuffle=False,  # tf.data already shuffles
+                     verbose=verbose)
 
     return linear_model
 
 
-def make_gbdt(train_dataset, n_estimators=100, max_depth=3, random_state=23):
+def _set_tf_threads(num_threads):
+    """Sets the number of threads tensorflow uses within and across
+    operations, warning if tensorflow has already started."""
+
+    from tensorflow.config import threading
+
+    try:
+        threading.set_intra_op_parallelism_threads(num_threads)
+        threading.set_inter_op_parallelism_threads(num_threads)
+    except RuntimeError:
+        warn("Tensorflow is already running, so its thread counts cannot "
+             "be changed; set num_threads in the first model made.",
+             UserWarning)
+
+
+def _throughput_callback(num_tracks):
+    """Returns a keras callback adding each epoch's training throughput
+    to its logs as "tracks_per_second". The clock stops at the last
+    training batch, so validation time isn't counted. num_tracks is
+    either the number of tracks per epoch or a variable from
+    _count_tracks(), which is reset at the start of each epoch."""
+
+    from time import perf_counter
+    from tensorflow.keras.callbacks import Callback
+
+    class ThroughputLogger(Callback):
+
+        def on_epoch_begin(self, epoch, logs=None):
+            if not isinstance(num_tracks, int):
+                num_tracks.assign(0)
+            self.start = self.end = perf_counter()
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.end = perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_tracks = num_tracks if isinstance(num_tracks, int) \
+                else int(num_tracks.numpy())
+            if logs is not None:
+                logs["tracks_per_second"] = \
+                    epoch_tracks / (self.end - self.start)
+
+    return ThroughputLogger()
+
+
+def _count_tracks(tfds):
+    """Returns a batched tf.data.Dataset passing its batches through
+    unchanged while adding up their tracks, along with the variable
+    holding that count."""
+
+    from tensorflow import Variable
+    from tensorflow import int64
+    from tensorflow import shape as tfshape
+
+    num_tracks = Variable(0, dtype=int64, trainable=False)
+
+    def count_batch(data, *rest):
+        num_tracks.assign_add(tfshape(data, out_type=int64)[0])
+        return (data,) + rest
+
+    return tfds.map(count_batch), num_tracks
+
+
+def _tf_dataset(dataset, batch_size, shuffle=True):
+    """Returns the given dataset as a batched tf.data.Dataset, passing
+    tf.data.Datasets through unchanged."""
+
+    return dataset.to_tf_dataset(batch_size, shuffle=shuffle) \
+        if hasattr(dataset, "to_tf_dataset") else dataset
+
+
+def make_gbdt(train_dataset, n_estimators=100, max_depth=3, random_state=23,
+              backend="exact", eval_dataset=None, n_iter_no_change=10):
     """Make a gradient boosted decision tree in sklearn using training
     data, using Claire's model as reference for creation parameters.
 
+    The "exact" backend is sklearn's GradientBoostingClassifier, which
+    considers every split and runs on one thread. The "hist" backend
+    is its HistGradientBoostingClassifier, which bins each property
+    first and builds trees on all cores, and is far faster on large
+    datasets. Both return a model with predict_proba(), so either works
+    with ndmlpred and the ROC plots.
+
     Args:
         train_dataset: a TrackPropertiesDataset that the model will
             train on.
         n_estimators, max_depth, random_state: check out the sklearn
-            documentation for a GradientBoostingClassifier.
+            documentation for a GradientBoostingClassifier. For the
+            hist backend, n_estimators is the maximum number of
+            boosting iterations.
+        backend: either "exact" or "hist".
+        eval_dataset: a TrackPropertiesDataset to stop training early
+            on, for the hist backend: training stops once the loss on
+            it has not improved for n_iter_no_change iterations. With
+            scikit-learn older than 1.6, which can't be given
+            validation data, the eval data is instead added to the
+            training data and a random fraction of the same size is
+            held out for stopping.
+        n_iter_no_change: see eval_dataset.
 
     Returns:
         A trained sklearn gradient boosted decision tree.
+
+    Raises:
+        ValueError: if the backend is not "exact" or "hist".
     """
 
-    gbdt = GradientBoostingClassifier(
-        n_estimators=n_estimators,
-        max_depth=max_depth,
-        random_state=random_state)
-    gbdt.fit(train_dataset.get_data().numpy(),
-             train_dataset.get_labels().numpy())
+    if backend == "exact":
+        from sklearn.ensemble import GradientBoostingClassifier
+
+        if eval_dataset is not None:
+            warn("The exact backend cannot stop early on an eval dataset; "
+                 "ignoring it. Use backend=\"hist\".", UserWarning)
+
+        gbdt = GradientBoostingClassifier(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            random_state=random_state)
+        gbdt.fit(train_dataset.get_data(as_numpy=True),
+                 _label_array(train_dataset))
+
+    elif backend == "hist":
+        from inspect import signature
+        from numpy import concatenate
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        gbdt = HistGradientBoostingClassifier(
+            max_iter=n_estimators,
+            max_depth=max_depth,
+            random_state=random_state,
+            early_stopping=eval_dataset is not None,
+            n_iter_no_change=n_iter_no_change)
+        if eval_dataset is None:
+            gbdt.fit(train_dataset.get_data(as_numpy=True),
+                     _label_array(train_dataset))
+        elif "X_val" in signature(gbdt.fit).parameters:
+            gbdt.fit(train_dataset.get_data(as_numpy=True),
+                     _label_array(train_dataset),
+                     X_val=eval_dataset.get_data(as_numpy=True),
+                     y_val=_label_array(eval_dataset))
+        else:
+            warn("This scikit-learn can't stop early on given validation "
+                 "data; holding out a random fraction the size of "
+                 "eval_dataset instead.", UserWarning)
+            gbdt.set_params(validation_fraction=eval_dataset.size()
+                            / (train_dataset.size() + eval_dataset.size()))
+            gbdt.fit(concatenate([train_dataset.get_data(as_numpy=True),
+                                  eval_dataset.get_data(as_numpy=True)]),
+                     concatenate([_label_array(train_dataset),
+                                  _label_array(eval_dataset)]))
+
+    else:
+        raise ValueError("GBDT backend must be \"exact\" or \"hist\", "
+                         "not {}.".format(backend))
 
     return gbdt
+
+
+def _label_array(dataset):
+    """Returns the labels of a TrackPropertiesDataset as a numpy array,
+    without going through tensorflow."""
+
+    return dataset.to_track_prop_dict(copy=False)[
+        dataset.get_label_property()]
@@ -1,6 +1,5 @@
+from numpy import asarray
 from numpy import linspace
-import matplotlib.pyplot as plt
-from sklearn.metrics import roc_curve, roc_auc_score
 from .. import plot as ndplot
 from . import predict as ndmlpred
 
@@ -17,12 +16,12 @@ def plot_pred_comparison_by_track_property(dataset, pred_name,
         pred_comparison: a function that takes in the labels, the
             predicted labels, and a threshold value, and returns a
             number measuring some property of the predicted labels'
-            relation to the actual ones.
+            relation to the actual ones and its error.
         bin_property: a property in data_properties or the
             label_property that will split the dataset into bins.
         bins: either an int for the number of bins, a 3-tuple of the
             form (low_bound, high_bound, num_bins), or a list of
-            numbers. See ntupledict.operations.make_bins() for info.
+            numbers. See ntupledicts.analyze.make_bins() for info.
         threshold: the limit at which a prediction signifies one or
             the other value of a binary classification,
         legend_id: the entry in the legend for the line to be plotted.
@@ -33,10 +32,15 @@ def plot_pred_comparison_by_track_property(dataset, pred_name,
         The Axes object to be used to plot in this function.
     """
 
-    if ax is None:
-        ax = plt.figure().add_subplot(111)
+    # The comparisons in ndmlpred have one-pass binned versions
+    binned_metric = {ndmlpred.true_positive_rate: "tpr",
+                     ndmlpred.false_positive_rate: "fpr"}.get(pred_comparison)
+    if binned_metric is not None:
+        return plot_classifier_metric_by_track_property(dataset, pred_name,
+                binned_metric, bin_property, bins, threshold, legend_id, ax)
 
-    track_prop_dict = dataset.to_track_prop_dict(include_preds=True)
+    track_prop_dict = dataset.to_track_prop_dict(include_preds=True,
+                                                 copy=False)
 
     def measure_pred_comparison(track_prop_dict):
         """Measures some prediction comparison of true labels and
@@ -54,6 +58,43 @@ def plot_pred_comparison_by_track_property(dataset, pred_name,
             measure_pred_comparison, bins, legend_id, ax)
 
 
+def plot_classifier_metric_by_track_property(dataset, pred_name, metric,
+        bin_property, bins=10, threshold=.6, legend_id=None, ax=None):
+    """Plots a classifier metric of a prediction binned by a track
+    property, computed for all bins in one pass by
+    ndmlpred.classifier_metrics_by_bin().
+
+    Args:
+        dataset: a TrackPropertiesDataset.
+        pred_name: the name of a prediction to be found in dataset.
+        metric: one of "tpr", "fpr", "precision", or "auc".
+        bin_property: a property in data_properties or the
+            label_property that will split the dataset into bins.
+        bins: either an int for the number of bins, a 3-tuple of the
+            form (low_bound, high_bound, num_bins), or a list of
+            numbers. See ntupledicts.analyze.make_bins() for info.
+        threshold: the limit at which a prediction signifies one or
+            the other value of a binary classification. Not used for
+            the AUC.
+        legend_id: the entry in the legend for the line to be plotted.
+            Calling ax.legend() should be done outside this function.
+        ax: an axes object to be used to plot in this function.
+
+    Returns:
+        The Axes object to be used to plot in this function.
+    """
+
+    track_prop_dict = dataset.to_track_prop_dict(copy=False)
+    bins, metrics = ndmlpred.classifier_metrics_by_bin(
+            track_prop_dict[dataset.get_label_property()],
+            dataset.get_prediction(pred_name),
+            track_prop_dict[bin_property], bins, threshold, [metric])
+    bin_heights, bin_errs = metrics[metric]
+
+    return ndplot.draw_measure_by_bin(bins, bin_heights, bin_errs,
+            bin_property, legend_id, ax)
+
+
 def plot_pred_comparison_by_threshold(dataset, pred_name,
         pred_comparison, thresholds=10, legend_id=None,
         ax=None):
@@ -66,7 +107,9 @@ def plot_pred_comparison_by_threshold(dataset, pred_name,
         pred_comparison: a function that takes in the labels, the
             predicted labels, and a threshold value, and returns a
             number measuring some property of the predicted labels'
-            relation to the actual ones.
+            relation to the actual ones and its error. If it also
+            accepts an array of thresholds, as those in ndmlpred do,
+            it is called once for all of them.
         thresholds: the limits at which a prediction signifies one or
             the other value of a binary classification.
         legend_id: the entry in the legend for the line to be plotted.
@@ -78,7 +121,7 @@ def plot_pred_comparison_by_threshold(dataset, pred_name,
     """
 
     if ax is None:
-        ax = plt.figure().add_subplot(111)
+        ax = _new_axes()
 
     # Generate threshold list if thresholds is not a list
     if not isinstance(thresholds, list):
@@ -87,12 +130,20 @@ def plot_pred_comparison_by_threshold(dataset, pred_name,
     labels = dataset.get_labels()
     predictions = dataset.get_prediction(pred_name)
 
-    pred_comps_with_errors = list(map(lambda threshold:
-        pred_comparison(labels, predictions, threshold),
-        thresholds))
+    # Comparisons from ndmlpred take every threshold in one call, which
+    # sorts the predictions once. Others are called per threshold.
+    try:
+        pred_comps, pred_errs = pred_comparison(labels, predictions,
+                                                asarray(thresholds))
+        if len(pred_comps) != len(thresholds):
+            raise ValueError("Comparison does not accept many thresholds.")
+    except (TypeError, ValueError):
+        pred_comps_with_errors = list(map(lambda threshold:
+            pred_comparison(labels, predictions, threshold),
+            thresholds))
 
-    pred_comps = list(map(lambda l: l[0], pred_comps_with_errors))
-    pred_errs = list(map(lambda l: l[1], pred_comps_with_errors))
+        pred_comps = list(map(lambda l: l[0], pred_comps_with_errors))
+        pred_errs = list(map(lambda l: l[1], pred_comps_with_errors))
 
     ax.errorbar(thresholds, pred_comps, pred_errs,
         label=legend_id, fmt=".")
@@ -122,22 +173,75 @@ def plot_rocs(dataset, prob_pred_names=[], def_pred_names=[],
         The axes object to used to plot in this function.
     """
 
-    ax = plt.figure().add_subplot(111)
+    return draw_rocs(*compute_rocs(dataset, prob_pred_names, def_pred_names),
+                     xlims, ylims)
 
-    # Plot ROC curve for models
+
+def compute_rocs(dataset, prob_pred_names=[], def_pred_names=[]):
+    """Computes the ROC curves and cut points drawn by plot_rocs().
+
+    Args:
+        dataset: a TrackPropertiesDataset containing the data, labels,
+            and corresponding property names for both.
+        prob_pred_names: names of probablistic predictions accessible
+            from dataset.
+        def_pred_names: names of pre-thresholded predictions
+            accessible from the dataset.
+
+    Returns:
+        A list of ROC curves and a list of cut points, of the forms
+        accepted by draw_rocs().
+    """
+
+    from sklearn.metrics import roc_curve, roc_auc_score
+
+    # Compute ROC curves for models
     labels = dataset.get_labels()
+    roc_curves = []
     for prob_pred_name in prob_pred_names:
         pred_prob_labels = dataset.get_prediction(prob_pred_name)
         fpr, tpr, _ = roc_curve(labels, pred_prob_labels)
         auc = roc_auc_score(labels, pred_prob_labels)
-        label = "{} ({})".format(prob_pred_name, str(round(auc, 3)))
-        ax.plot(fpr, tpr, label=label, linewidth=2)
+        roc_curves.append((prob_pred_name, list(fpr), list(tpr), auc))
 
-    # Plot cuts, if any are given
+    # Compute cut points, if any are given
+    cut_points = []
     for def_pred_name in def_pred_names:
         pred_labels = dataset.get_prediction(def_pred_name)
         fpr_cut = ndmlpred.false_positive_rate(labels, pred_labels)
         tpr_cut = ndmlpred.true_positive_rate(labels, pred_labels)
+        cut_points.append((def_pred_name, fpr_cut, tpr_cut))
+
+    return roc_curves, cut_points
+
+
+def draw_rocs(roc_curves, cut_points=[], xlims=(0, .3), ylims=(.9, 1),
+              ax=None):
+    """Draws the plot made by plot_rocs() from already computed ROC
+    curves and cut points.
+
+    Args:
+        roc_curves: a list of tuples of a prediction name, a list of
+            false positive rates, a list of true positive rates, and
+            the area under the curve. Plotted as curves.
+        cut_points: a list of tuples of a prediction name, a false
+            positive rate, and a true positive rate. Plotted as points.
+        xlims, ylims: the plotted ranges of false and true positive
+            rate.
+        ax: an axes object to be used to plot in this function.
+
+    Returns:
+        The axes object to used to plot in this function.
+    """
+
+    if ax is None:
+        ax = _new_axes()
+
+    for prob_pred_name, fpr, tpr, auc in roc_curves:
+        label = "{} ({})".format(prob_pred_name, str(round(auc, 3)))
+        ax.plot(fpr, tpr, label=label, linewidth=2)
+
+    for def_pred_name, fpr_cut, tpr_cut in cut_points:
         ax.scatter(fpr_cut, tpr_cut, s=80, marker="*",
                 label="cuts: {}".format(def_pred_name), color="red")
 
@@ -149,3 +253,12 @@ def plot_rocs(dataset, prob_pred_names=[], def_pred_names=[],
     ax.legend(loc="best", fontsize=14)
 
     return ax
+
+
+def _new_axes():
+    """Returns the axes of a new pyplot figure. pyplot is imported here,
+    on first use, so that importing this module stays fast."""
+
+    import matplotlib.pyplot as plt
+
+    return plt.figure().add_subplot(111)
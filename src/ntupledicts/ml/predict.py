@@ -2,7 +2,28 @@
 
 from .. import operations as ndops
 from .. import analyze as ndanl
+from . import cache as ndmlcache
 from ..operations import select as sel
+from concurrent.futures import ThreadPoolExecutor
+from numpy import append
+from numpy import arange
+from numpy import asarray
+from numpy import bincount
+from numpy import count_nonzero
+from numpy import cumsum
+from numpy import empty
+from numpy import float32
+from numpy import int8
+from numpy import lexsort
+from numpy import maximum
+from numpy import ndim
+from numpy import ones
+from numpy import searchsorted
+from numpy import sort
+from numpy import sqrt
+from numpy import uint8
+from numpy import where
+from numpy import zeros
 
 
 def check_pred_labels_size(labels, pred_labels):
@@ -17,10 +38,114 @@ def apply_threshold(pred_prob_labels, threshold):
     """Sends every prediction in the list below the threshold
     (exclusive) to zero and everything above it (inclusive) to one.
     In the parlance of this file, turns predicted probablistic labels
-    into predicted labels. Returns a list."""
+    into predicted labels. Returns an int8 numpy array.
 
-    return list(map(lambda pred: 1 if pred >= threshold else 0,
-        pred_prob_labels))
+    For predictions stored in a TrackPropertiesDataset, use its
+    get_thresholded_prediction(), which caches the result."""
+
+    return (asarray(pred_prob_labels) >= threshold).astype(int8)
+
+
+def confusion_counts_by_threshold(labels, pred_prob_labels, thresholds):
+    """Counts the true positives, false positives, true negatives, and
+    false negatives of a binary classifier at every given threshold at
+    once. The predictions of each true label are sorted once, and the
+    counts at each threshold are read off with a binary search, rather
+    than thresholding all predictions again for each threshold.
+
+    Args:
+        labels: a list, array, or tensor of binary classifier labels.
+        pred_prob_labels: a list or array of probablistic predictions.
+        thresholds: a threshold, or a list of them. Predictions at or
+            above a threshold count as positive.
+
+    Returns:
+        2-tuples of a count and its binomial error for the true
+        positives, false positives, true negatives, and false
+        negatives. The counts and errors are arrays with one entry per
+        threshold, or numbers if a single threshold is given.
+
+    Raises:
+        ValueError: if the true and predicted labels differ in size.
+    """
+
+    (true_positives, false_positives, true_negatives, false_negatives), \
+        (num_positives, num_negatives) = _confusion_counts(
+            labels, pred_prob_labels, thresholds)
+
+    return tuple(map(lambda count, class_size:
+                     (count, _count_error(count, class_size)),
+                     (true_positives, false_positives, true_negatives,
+                      false_negatives),
+                     (num_positives, num_negatives, num_negatives,
+                      num_positives)))
+
+
+def _confusion_counts(labels, pred_prob_labels, thresholds):
+    """Returns the true positive, false positive, true negative, and
+    false negative counts at each threshold, along with the numbers of
+    true positive and true negative labels."""
+
+    check_pred_labels_size(labels, pred_prob_labels)
+
+    labels = _label_array(labels)
+    pred_prob_labels = asarray(pred_prob_labels)
+    positives = pred_prob_labels[ndops.val_list_mask(labels, sel(1))]
+    negatives = pred_prob_labels[ndops.val_list_mask(labels, sel(0))]
+
+    true_positives = _count_at_or_above(positives, thresholds)
+    false_positives = _count_at_or_above(negatives, thresholds)
+
+    return (true_positives, false_positives,
+            len(negatives) - false_positives,
+            len(positives) - true_positives), \
+        (len(positives), len(negatives))
+
+
+def _count_error(count, class_size):
+    """Returns the binomial error of counts out of a class of tracks,
+    or zero for an empty class."""
+
+    if class_size == 0:
+        return count * 0.
+    return sqrt(count * (1 - count / class_size))
+
+
+def _count_at_or_above(pred_prob_labels, thresholds):
+    """Returns how many predictions are at or above each threshold,
+    sorting the predictions once. Thresholds are compared in the
+    precision of the predictions, as in apply_threshold()."""
+
+    if pred_prob_labels.dtype.kind == "f":
+        thresholds = asarray(thresholds, dtype=pred_prob_labels.dtype)
+
+    return len(pred_prob_labels) - searchsorted(
+        sort(pred_prob_labels), thresholds, side="left")
+
+
+def _label_array(labels):
+    """Returns labels given as a list, array, or tensor as an array."""
+
+    return labels.numpy() if hasattr(labels, "numpy") else asarray(labels)
+
+
+def _proportions_and_errors(nums_in_case, domain_size):
+    """Divides counts by the size of their domain and finds the error
+    of each, matching the scalar or array shape of the counts. If the
+    domain is empty, the proportions and errors are zero."""
+
+    if ndim(nums_in_case) == 0:
+        if domain_size == 0:
+            return 0, 0
+        return int(nums_in_case) / domain_size, ndanl.pred_error(
+            int(domain_size), int(nums_in_case))
+
+    if domain_size == 0:
+        return zeros(len(nums_in_case)), zeros(len(nums_in_case))
+    return asarray(nums_in_case) / domain_size, asarray(list(map(
+        lambda num_in_case: ndanl.pred_error(int(domain_size),
+                                             int(num_in_case)),
+        nums_in_case)))
 
 
 def pred_proportion_given_truth_case(labels, pred_labels,
@@ -29,7 +154,9 @@ def pred_proportion_given_truth_case(labels, pred_labels,
     probability labels, looking only at values who match to an acutal
     label of a particular case.
 
-    This is the generalization of true and false positive rates.
+    This is the generalization of true and false positive rates. Like
+    those, it accepts a list of thresholds as well as a single one,
+    sorting the predictions once for all of them.
 
     Args:
         labels: a list or tensor of binary classifer labels.
@@ -41,13 +168,15 @@ def pred_proportion_given_truth_case(labels, pred_labels,
         pred_label_case: a function returning true for values to count
             part of the proportion in the prediction with restricted
             domain.
-        threshold: a threshold to apply to the probablistic data
-            before computing the agreement. Assumes binary classifier.
+        threshold: a threshold, or list of thresholds, to apply to the
+            probablistic data before computing the agreement. Assumes
+            binary classifier.
 
     Returns:
         The proportion of predicted values meeting a certain case given
         a restriction of true values meeting a certain case, and the
-        error in prediction.
+        error in prediction. These are arrays if a list of thresholds
+        is given.
 
     Raises:
         ValueError: if the true and predicted labels differ in size.
@@ -55,23 +184,15 @@ def pred_proportion_given_truth_case(labels, pred_labels,
 
     check_pred_labels_size(labels, pred_labels)
 
-    labels_meet_restriction = list(map(lambda label:
-        bool(label_restriction(label)),
-        labels if isinstance(labels, list) else labels.numpy()))
-    pred_labels_meet_case = list(map(pred_label_case,
-        apply_threshold(pred_labels, threshold)))
+    in_domain = ndops.val_list_mask(_label_array(labels), label_restriction)
+    domain_size = int(count_nonzero(in_domain))
 
-    domain_size = sum(labels_meet_restriction)
-    if domain_size == 0:
-        return 0, 0
-
-    num_pred_labels_meet_case_in_domain = sum(map(
-        lambda label_meets_restriction, pred_label_meets_case:
-        label_meets_restriction and pred_label_meets_case,
-        labels_meet_restriction, pred_labels_meet_case))
+    # Thresholded predictions are ones or zeros, so count each by case
+    num_ones = _count_at_or_above(asarray(pred_labels)[in_domain], threshold)
+    nums_in_case = num_ones * bool(pred_label_case(1)) \
+        + (domain_size - num_ones) * bool(pred_label_case(0))
 
-    return num_pred_labels_meet_case_in_domain / domain_size, ndanl.pred_error(
-            domain_size, num_pred_labels_meet_case_in_domain)
+    return _proportions_and_errors(nums_in_case, domain_size)
 
 
 def true_positive_rate(labels, pred_labels, threshold=.6):
@@ -84,18 +205,22 @@ def true_positive_rate(labels, pred_labels, threshold=.6):
         pred_labels: a list of predicted binary classifier labels,
             OR a list of probablistic predictions to be converted to
             exact predictions using the threshold.
-        threshold: a threshold to apply to the probablistic data.
+        threshold: a threshold to apply to the probablistic data, or a
+            list of them.
 
     Returns:
         The proportion of "true" cases that a model predicted correctly
-        and the prediction error.
+        and the prediction error. These are arrays if a list of
+        thresholds is given.
 
     Raises:
         ValueError: if the true and predicted labels differ in size.
     """
 
-    return pred_proportion_given_truth_case(labels, pred_labels,
-            sel(1), sel(1), threshold)
+    (true_positives, _, _, _), (num_positives, _) = _confusion_counts(
+        labels, pred_labels, threshold)
+
+    return _proportions_and_errors(true_positives, num_positives)
 
 
 def false_positive_rate(labels, pred_labels, threshold=.6):
@@ -108,65 +233,299 @@ def false_positive_rate(labels, pred_labels, threshold=.6):
         pred_labels: a list of predicted binary classifier labels,
             OR a list of probablistic predictions to be converted to
             exact predictions using the threshold.
-        threshold: a threshold to apply to the probablistic data.
+        threshold: a threshold to apply to the probablistic data, or a
+            list of them.
 
     Returns:
         The proportion of "false" cases that a model predicted "true"
-        and the error in prediction.
+        and the error in prediction. These are arrays if a list of
+        thresholds is given.
 
     Raises:
         ValueError: if the true and predicted labels differ in size.
     """
 
-    return pred_proportion_given_truth_case(labels, pred_labels,
-            sel(0), sel(1), threshold)
+    (_, false_positives, _, _), (_, num_negatives) = _confusion_counts(
+        labels, pred_labels, threshold)
+
+    return _proportions_and_errors(false_positives, num_negatives)
+
 
+def classifier_metrics_by_bin(labels, pred_labels, bin_val_list, bins=10,
+                              threshold=.6,
+                              metrics=("tpr", "fpr", "precision", "auc")):
+    """Finds the true positive rate, false positive rate, precision, and
+    AUC of a binary classifier within each bin of some track property,
+    all in one pass.
 
-def predict_labels(model, data):
+    Every track is given a confusion cell (bin, label, thresholded
+    prediction), and one bincount over those cells gives every bin's
+    confusion counts. The AUC in each bin comes from the ranks of its
+    predictions, found with one sort over all bins.
+
+    Args:
+        labels: a list, array, or tensor of binary classifier labels.
+        pred_labels: a list or array of probablistic predictions.
+        bin_val_list: the values of the track property to bin by, one
+            per track.
+        bins: either an int for the number of bins, a 3-tuple of the
+            form (low_bound, high_bound, num_bins), or a list of
+            numbers. See ntupledicts.analyze.make_bins() for info.
+        threshold: the threshold for the rates and precision.
+        metrics: the metrics to find. The AUC needs a sort of all
+            tracks, so leave it out when it is not wanted.
+
+    Returns:
+        The bins, and a dict from each of the given metrics to a list
+        of that metric in each bin and a list of the errors.
+        A metric is zero with zero error in a bin where it is undefined.
+
+    Raises:
+        ValueError: if the true and predicted labels differ in size.
+    """
+
+    check_pred_labels_size(labels, pred_labels)
+
+    bins, bin_indices, _ = ndanl.bin_val_list(bin_val_list, bins)
+    num_bins = len(bins) - 1
+    labels = _label_array(labels)
+    pred_labels = asarray(pred_labels)
+    is_positive = ndops.val_list_mask(labels, sel(1))
+    considered = (bin_indices >= 0) & (bin_indices < num_bins) \
+        & (is_positive | ndops.val_list_mask(labels, sel(0)))
+    bin_indices = bin_indices[considered]
+    is_positive = is_positive[considered]
+    pred_labels = pred_labels[considered]
+
+    passes_threshold = pred_labels >= (asarray(threshold, pred_labels.dtype)
+        if pred_labels.dtype.kind == "f" else threshold)
+    true_negatives, false_positives, false_negatives, true_positives = \
+        bincount(bin_indices * 4 + is_positive * 2 + passes_threshold,
+                 minlength=num_bins * 4).reshape(num_bins, 4).T
+    num_positives = true_positives + false_negatives
+    num_negatives = false_positives + true_negatives
+
+    def proportions_and_errors(nums_in_case, domain_sizes):
+        """Returns lists of the proportion and error in each bin."""
+
+        props_and_errs = list(map(_proportions_and_errors,
+                                  nums_in_case, domain_sizes))
+        return list(map(lambda l: float(l[0]), props_and_errs)), \
+            list(map(lambda l: float(l[1]), props_and_errs))
+
+    def aucs_and_errors():
+        aucs = _aucs_by_bin(bin_indices, is_positive, pred_labels, num_bins,
+                            num_positives, num_negatives)
+        return aucs.tolist(), _auc_errors(aucs, num_positives,
+                                          num_negatives).tolist()
+
+    find_metric = {
+        "tpr": lambda: proportions_and_errors(true_positives, num_positives),
+        "fpr": lambda: proportions_and_errors(false_positives, num_negatives),
+        "precision": lambda: proportions_and_errors(true_positives,
+            true_positives + false_positives),
+        "auc": aucs_and_errors}
+
+    return bins, dict(map(lambda metric: (metric, find_metric[metric]()),
+                          metrics))
+
+
+def _aucs_by_bin(bin_indices, is_positive, pred_labels, num_bins,
+                 num_positives, num_negatives):
+    """Returns the AUC in each bin by the Mann-Whitney rank sum of its
+    positive tracks, ranking the predictions within every bin with one
+    sort. Tied predictions share their average rank."""
+
+    track_order = lexsort((pred_labels, bin_indices))
+    sorted_bins = bin_indices[track_order]
+    sorted_preds = pred_labels[track_order]
+    num_tracks = len(track_order)
+
+    # Runs of equal predictions within a bin share a rank
+    run_starts = ones(num_tracks, dtype=bool)
+    run_starts[1:] = (sorted_bins[1:] != sorted_bins[:-1]) \
+        | (sorted_preds[1:] != sorted_preds[:-1])
+    run_ends = append(run_starts[1:], True)
+    ranks = arange(1, num_tracks + 1) \
+        - searchsorted(sorted_bins, arange(num_bins))[sorted_bins]
+    run_ids = cumsum(run_starts) - 1
+    mid_ranks = (ranks[run_starts][run_ids] + ranks[run_ends][run_ids]) / 2
+
+    sorted_positive = is_positive[track_order]
+    positive_rank_sums = bincount(sorted_bins[sorted_positive],
+        weights=mid_ranks[sorted_positive], minlength=num_bins)
+
+    num_pairs = num_positives * num_negatives
+    return where(num_pairs > 0, (positive_rank_sums
+        - num_positives * (num_positives + 1) / 2)
+        / where(num_pairs > 0, num_pairs, 1), 0)
+
+
+def _auc_errors(aucs, num_positives, num_negatives):
+    """Returns the Hanley-McNeil standard error of each AUC, or zero
+    where the AUC is undefined."""
+
+    num_pairs = num_positives * num_negatives
+    q1 = aucs / (2 - aucs)
+    q2 = 2 * aucs ** 2 / (1 + aucs)
+    variances = (aucs * (1 - aucs) + (num_positives - 1) * (q1 - aucs ** 2)
+                 + (num_negatives - 1) * (q2 - aucs ** 2)) \
+        / where(num_pairs > 0, num_pairs, 1)
+
+    return where(num_pairs > 0, sqrt(maximum(variances, 0)), 0)
+
+
+def predict_labels(model, data, use_cache=True):
     """Run the model on each element of a dataset and produce a list of
     probabilistic predictions (note: not logits). Assumes a binary
     classifier. Does not apply a threshold.
 
+    Predictions are kept in the on-disk cache from
+    ndmlcache.get_inference_cache(), keyed on the model's learned state
+    and the data, so predicting again with an unchanged model on the
+    same data reads them back instead.
+
     Args:
         model: a tensorflow or sklearn model capable of prediction.
         data: an array of elements that the model can use to make
             predictions.
+        use_cache: if False, neither read from nor write to the cache.
 
     Returns:
-        A Python list of probabilistic predictions.
+        A float32 numpy array of probabilistic predictions.
     """
 
+    cache = ndmlcache.get_inference_cache() if use_cache else None
+    cache_key = None if cache is None else cache.make_key(model, data)
+    if cache_key is not None:
+        pred_prob_labels = cache.get(cache_key)
+        if pred_prob_labels is not None:
+            return pred_prob_labels
+
     # Different models predict in different ways
     if "keras" in str(type(model)):
-        pred_prob_labels = map(lambda l: l[0], model.predict(data))
+        pred_prob_labels = asarray(model.predict(data))[:, 0]
     else:
-        pred_prob_labels = map(lambda l: l[1], model.predict_proba(data))
+        pred_prob_labels = asarray(model.predict_proba(data))[:, 1]
+    pred_prob_labels = pred_prob_labels.astype(float32)
 
-    return list(pred_prob_labels)
+    if cache_key is not None:
+        cache.put(cache_key, pred_prob_labels)
 
+    return pred_prob_labels
 
-def predict_labels_cuts(tpd_selector, dataset):
-    """Return a list of labels corresponding to which tracks were
-    selected in a dataset. Interpreted in the context of this ML
-    package as predicting some binary track property based on cuts.
+
+def run_models(models, dataset, batch_size=65536, num_workers=None,
+               track_properties=None, use_cache=True):
+    """Runs several models over a dataset at once and stores each one's
+    predictions in the dataset under its name.
+
+    The feature matrix is taken once from the dataset's cache and fed
+    to the models in fixed-size batches, which are views into it, so no
+    model rebuilds the features. Batches of all models run concurrently
+    on a thread pool, each writing straight into its model's output
+    array. Selector dicts are treated as cuts and go through
+    predict_labels_cuts(). As with predict_labels(), predictions found
+    in the inference cache, keyed on the feature matrix fed to the
+    models, are not recomputed.
+
+        run_models({"NN": NN, "GBDT": GBDT, "cuts": {"chi2": sel(0, 21)}},
+                   test_ds)
+        test_ds.get_prediction("GBDT")
 
     Args:
-        tpd_selector: a selector for a track properties dict.
-        dataset: a TrackPropertiesDataset.
+        models: a dict from prediction names to tensorflow or sklearn
+            models, or to selector dicts.
+        dataset: a TrackPropertiesDataset with the data the models
+            were trained on active.
+        batch_size: the number of tracks per batch.
+        num_workers: the number of threads. If None, uses the
+            concurrent.futures default.
+        track_properties: the track properties to feed the models. If
+            None, uses the active data properties.
+        use_cache: if False, neither read from nor write to the
+            inference cache.
 
     Returns:
-        A Python list of labels corresponding to which tracks were
-        selected in a dataset.
+        The dataset, with the new predictions added.
     """
 
-    track_prop_dict = dataset.to_track_prop_dict()
+    model_names = list(filter(lambda pred_name:
+                              not isinstance(models[pred_name], dict), models))
+    for pred_name in filter(lambda pred_name: pred_name not in model_names,
+                            models):
+        dataset.add_prediction(pred_name,
+                               predict_labels_cuts(models[pred_name], dataset))
+
+    if not model_names:
+        return dataset
+    data = dataset.get_data(track_properties, as_numpy=True)
+
+    # Take whatever predictions the cache already has
+    cache = ndmlcache.get_inference_cache() if use_cache else None
+    cache_keys = dict.fromkeys(model_names)
+    if cache is not None:
+        data_digest = ndmlcache.data_digest(data)
+        feature_spec = list(dataset.get_active_data_properties()
+                            if track_properties is None else track_properties)
+        cache_keys = dict(map(lambda pred_name: (pred_name, cache.make_key(
+            models[pred_name], data_digest, feature_spec)), model_names))
+    for pred_name in list(model_names):
+        cached_pred_labels = None if cache_keys[pred_name] is None \
+            else cache.get(cache_keys[pred_name])
+        if cached_pred_labels is not None:
+            dataset.add_prediction(pred_name, cached_pred_labels)
+            model_names.remove(pred_name)
+    if not model_names:
+        return dataset
+
+    pred_prob_labels = dict(map(lambda pred_name:
+                                (pred_name, empty(dataset.size(), float32)),
+                                model_names))
+
+    def predict_batch(batch_job):
+        pred_name, start = batch_job
+        end = min(start + batch_size, dataset.size())
+        pred_prob_labels[pred_name][start:end] = _predict_batch(
+            models[pred_name], data[start:end])
+
+    batch_jobs = [(pred_name, start) for pred_name in model_names
+                  for start in range(0, dataset.size(), batch_size)]
+    with ThreadPoolExecutor(num_workers) as executor:
+        list(executor.map(predict_batch, batch_jobs))
+
+    for pred_name in model_names:
+        dataset.add_prediction(pred_name, pred_prob_labels[pred_name])
+        if cache_keys[pred_name] is not None:
+            cache.put(cache_keys[pred_name], pred_prob_labels[pred_name])
+
+    return dataset
+
+
+def _predict_batch(model, batch):
+    """Returns a model's probabilistic predictions for one batch of
+    data. Keras models are called on the batch directly rather than
+    through predict(), which sets up its own batching, progress bar,
+    and traced function for every call."""
+
+    if "keras" in str(type(model)):
+        return asarray(model(batch, training=False))[:, 0]
+    return asarray(model.predict_proba(batch))[:, 1]
+
 
-    cut_indices = ndops.select_indices(track_prop_dict, tpd_selector)
+def predict_labels_cuts(tpd_selector, dataset):
+    """Return labels corresponding to which tracks were selected in a
+    dataset. Interpreted in the context of this ML package as
+    predicting some binary track property based on cuts.
 
-    pred_labels = [1 for _ in range(
-        ndops.track_prop_dict_length(track_prop_dict))]
-    for cut_index in cut_indices:
-        pred_labels[cut_index] = 0
+    Args:
+        tpd_selector: a selector for a track properties dict.
+        dataset: a TrackPropertiesDataset.
 
-    return pred_labels
+    Returns:
+        A uint8 numpy array that is one for each track that passes
+        every cut and zero for the rest.
+    """
 
+    return (~ndops.select_mask(dataset.to_track_prop_dict(copy=False),
+                               tpd_selector)).view(uint8)
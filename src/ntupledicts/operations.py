@@ -10,6 +10,8 @@ from numpy import cumsum
 from numpy import array
 from numpy import delete
 from numpy import where
+from numpy import asarray
+from numpy import zeros
 
 
 def add_ntuple_dicts(ntuple_dicts):
@@ -322,6 +324,22 @@ def reduce_track_prop_dict(track_prop_dict, track_limit, min_index=0,
         track_prop_dict.keys(), track_prop_dict.values()))
 
 
+def get_split_sizes(split_list, num_tracks):
+    """Returns the sizes of data by normalizing the provided split
+    distribution and mutliplying by the number of tracks in such
+    a way that the resulting sizes add up to the original tracks."""
+
+    split_list_total = sum(split_list)
+    split_sizes = list(map(lambda split_val:
+        int(split_val * num_tracks / split_list_total),
+        split_list))
+
+    # Ensure the split sizes add up to the total number of tracks
+    split_sizes[-1] += num_tracks - sum(split_sizes)
+
+    return split_sizes
+
+
 def split_track_prop_dict(track_prop_dict, split_list):
     """Splits a track properties dict into smaller ones according to
     the relative sizes of split_list elements. There is no option to
@@ -336,21 +354,6 @@ def split_track_prop_dict(track_prop_dict, split_list):
         A list of track property dicts.
     """
 
-    def get_split_sizes(split_list, num_tracks):
-        """Returns the sizes of data by normalizing the provided split
-        distribution and mutliplying by the number of tracks in such
-        a way that the resulting sizes add up to the original tracks."""
-
-        split_list_total = sum(split_list)
-        split_sizes = list(map(lambda split_val:
-            int(split_val * num_tracks / split_list_total),
-            split_list))
-
-        # Ensure the split sizes add up to the total number of tracks
-        split_sizes[-1] += num_tracks - sum(split_sizes)
-
-        return split_sizes
-
     split_boundaries = [0] + list(cumsum(get_split_sizes(split_list,
             track_prop_dict_length(track_prop_dict))))
 
@@ -382,19 +385,22 @@ def select(*selector_key, invert=False):
         ValueError: for invalid selector keys.
     """
 
+    # Selectors are written with elementwise operators so that they work
+    # on whole numpy arrays of values as well as on single values
     if len(selector_key) == 1:
         key_contents = next(iter(selector_key))
         if isinstance(key_contents, list):
-            selector = lambda val: any(map(
-                lambda sub_selector: sub_selector(val),
-                key_contents))
+            selector = lambda val: reduce(
+                lambda selected, sub_selector: selected | sub_selector(val),
+                key_contents, False)
         elif isinstance(key_contents, (float, int)):
             selector = lambda val: val == next(iter(selector_key))
         else:
             raise ValueError("Invalid selector key type: {}."
                     .format(type(key_contents)))
     elif len(selector_key) == 2:
-        selector = lambda val: selector_key[0] <= val <= selector_key[1]
+        selector = lambda val: (selector_key[0] <= val) \
+                & (val <= selector_key[1])
     else:
         raise ValueError("Invalid selector key length: {}. Read the docs!"
                          .format(selector_key))
@@ -480,19 +486,70 @@ def select_indices(track_prop_dict, tpd_selector, invert=True):
         dict.
     """
 
+    return list(where(select_mask(track_prop_dict, tpd_selector, invert))[0])
+
+
+def select_mask(track_prop_dict, tpd_selector, invert=True):
+    """Like select_indices(), but returns a boolean numpy array the
+    length of the track properties dict rather than a list of indices.
+    Only the value lists named in the selector dict are read.
+
+    Args:
+        track_prop_dict: a tracks properties dictionary.
+        tpd_selector: a dictionary from track property names to
+            selectors.
+        invert: mark all tracks NOT selected. Default is True.
+
+    Returns:
+        A boolean numpy array that is True for each track picked out.
+    """
+
     # Determine which selection conditions will be applied
-    for track_property in list(tpd_selector.keys()):
+    for track_property in tpd_selector.keys():
         if track_property not in track_prop_dict.keys():
             warn("{} not in tracks properties; will not select"
                     .format(track_property), UserWarning)
-            tpd_selector.pop(track_property)
 
-    tpd_length = track_prop_dict_length(track_prop_dict)
-    return list(set(sum(map(lambda track_property, selector:
-                            list(where([invert != selector(val) for val in\
-                                track_prop_dict[track_property]])[0]),
-                            tpd_selector.keys(), tpd_selector.values()),
-                        [])))
+    # Collect every index that any one selector picks out
+    picked = zeros(track_prop_dict_length(track_prop_dict), dtype=bool)
+    for track_property, selector in tpd_selector.items():
+        if track_property in track_prop_dict.keys():
+            picked |= invert != val_list_mask(
+                    track_prop_dict[track_property], selector)
+
+    return picked
+
+
+def val_list_mask(val_list, selector):
+    """Returns a boolean numpy array the length of a value list that is
+    True wherever the selector selects the corresponding value.
+
+    Numeric value lists are first handed to the selector whole, as a
+    numpy array. Selectors made by select(), and simple ones like
+    "lambda pt: pt < 2", then run at numpy speed. If the selector
+    raises or doesn't return one boolean per value (as with
+    "lambda eta: -2.4 <= eta <= 2.4"), it is instead called on each
+    value in turn.
+
+    Args:
+        val_list: a list or numpy array of values of a track property.
+        selector: a selector, as from select().
+
+    Returns:
+        A numpy array of booleans indexed by track.
+    """
+
+    val_array = asarray(val_list)
+    if val_array.dtype.kind in "biuf":
+        try:
+            mask = asarray(selector(val_array))
+        except (TypeError, ValueError):
+            mask = None
+        if mask is not None and mask.dtype == bool \
+                and mask.shape == val_array.shape:
+            return mask
+
+    return array([bool(selector(val)) for val in val_list], dtype=bool)
 
 
 def cut_track_prop_dict_by_indices(track_prop_dict, indices_to_cut):
@@ -1,8 +1,5 @@
-import matplotlib.pyplot as plt
 from . import analyze as ndanl
-from . import operations as ndops
-from .operations import select as sel
-from math import sqrt
+from numpy import asarray
 
 
 def plot_roc_curve_from_cut_list(ntuple_dict, cut_property, cuts,
@@ -20,9 +17,34 @@ def plot_roc_curve_from_cut_list(ntuple_dict, cut_property, cuts,
             bounds (inclusive). These are used rather than selectors so
             that information about the cut can be used in the final
             graph.
-        cuts_constricting: if the cuts are strictly in increasing order
-            of strictness, the same list can be preserved, decreasing
-            runtime. True by default.
+        cuts_constricting: if True, each cut is applied on top of all
+            the cuts before it, as when the cuts are in increasing order
+            of strictness. True by default.
+        group_name: a legend entry string for this curve to identify
+            itself others in an overlay
+        ax: an axes object to be used to plot this graph.
+
+    Returns:
+        The axes object used to plot this graph.
+    """
+
+    effs, fake_rates = ndanl.effs_and_fake_rates_from_cut_list(
+            ntuple_dict, cut_property, cuts, cuts_constricting)
+
+    return draw_roc_curve_from_cut_list(cuts, effs, fake_rates, group_name,
+                                        ax)
+
+
+def draw_roc_curve_from_cut_list(cuts, effs, fake_rates, group_name=None,
+                                 ax=None):
+    """Draws the plot made by plot_roc_curve_from_cut_list() from its
+    already computed efficiencies and fake rates.
+
+    Args:
+        cuts: a list of length 2 lists containing lower and upper cut
+            bounds. Each point is labeled with the upper bound.
+        effs: a list of efficiencies, indexed by cut.
+        fake_rates: a list of fake rates, indexed by cut.
         group_name: a legend entry string for this curve to identify
             itself others in an overlay
         ax: an axes object to be used to plot this graph.
@@ -32,43 +54,21 @@ def plot_roc_curve_from_cut_list(ntuple_dict, cut_property, cuts,
     """
 
     if ax is None:
-        ax = plt.figure().add_subplot(111)
-
-    # Build up cuts plot info, which is what will be plotted
-    cuts_plot_info = {"cut": [], "eff": [], "fake_rate": []}
-    cut_ntuple_dict = ntuple_dict
-    for cut in cuts:
-        # If cuts are constricting, use cut ntuple dict from previous iteration
-        ntuple_dict_to_cut = cut_ntuple_dict if cuts_constricting \
-            else ntuple_dict
-        tpd_selector = {cut_property: sel(*cut)}
-        cut_ntuple_dict = ndops.cut_ntuple_dict(ntuple_dict_to_cut,
-                                                {"trk": tpd_selector,
-                                                 "matchtrk": tpd_selector})
-        cuts_plot_info["cut"].append(cut[1])  # only get upper bound of cut
-        cuts_plot_info["eff"].append(ndanl.eff_from_ntuple_dict(
-            cut_ntuple_dict["tp"]["pt"]))
-        cuts_plot_info["fake_rate"].append(ndanl.get_proportion_selected(
-            cut_ntuple_dict["trk"]["genuine"], sel(0)))
-
-    # Now plot!
-    ax.plot(cuts_plot_info["fake_rate"], cuts_plot_info["eff"], "b.",
-            label=group_name)
+        ax = _new_axes()
+
+    ax.plot(fake_rates, effs, "b.", label=group_name)
 
     ax.set_xlabel("Track fake rate")
     ax.set_ylabel("Tracking efficiency")
     ax.legend()
-    for fake_rate, eff, cut in zip(
-            cuts_plot_info["fake_rate"],
-            cuts_plot_info["eff"],
-            cuts_plot_info["cut"]):
-        ax.annotate(str(cut), ax=(fake_rate, eff))
+    for fake_rate, eff, cut in zip(fake_rates, effs, cuts):
+        ax.annotate(str(cut[1]), xy=(fake_rate, eff))
 
     return ax
 
 
 def plot_measure_by_bin(track_prop_dict, bin_property, measure,
-                        bins=30, legend_id=None, ax=None):
+                        bins=30, legend_id=None, ax=None, executor=None):
     """Splits a track property dict into bins by some value, then
     computes a measure on each binned track property dict, including
     some error.
@@ -82,7 +82,37 @@ def plot_measure_by_bin(track_prop_dict, bin_property, measure,
             returns a numerical value and an error.
         bins: either an int for the number of bins, a 3-tuple of the
             form (low_bound, high_bound, num_bins), or a list of
-            numbers. See ntupledict.operations.make_bins() for info.
+            numbers. See ntupledicts.analyze.make_bins() for info.
+        legend_id: the entry in the legend for the line to be plotted.
+            Calling ax.legend() should be done outside this function.
+        ax: an axes object to overlay this data onto a previous plot.
+        executor: a concurrent.futures executor to run the measure on
+            each bin. See ntupledicts.analyze.take_measure_by_bin().
+
+    Returns:
+        A matplotlib.pyplot.Axes object for adjusting plot properties
+        and overlaying data.
+    """
+
+    bins, bin_heights, bin_errs = ndanl.take_measure_by_bin(track_prop_dict,
+                                                  bin_property, measure, bins,
+                                                  executor)
+
+    return draw_measure_by_bin(bins, bin_heights, bin_errs, bin_property,
+                               legend_id, ax)
+
+
+def draw_measure_by_bin(bins, bin_heights, bin_errs, bin_property,
+                        legend_id=None, ax=None):
+    """Draws the plot made by plot_measure_by_bin() from an already
+    computed measure, such as the output of
+    ntupledicts.analyze.take_measure_by_bin().
+
+    Args:
+        bins: a list of bin edges.
+        bin_heights: a list of the measure in each bin.
+        bin_errs: a list of the error in each bin.
+        bin_property: the property binned by, used as the x label.
         legend_id: the entry in the legend for the line to be plotted.
             Calling ax.legend() should be done outside this function.
         ax: an axes object to overlay this data onto a previous plot.
@@ -93,10 +123,8 @@ def plot_measure_by_bin(track_prop_dict, bin_property, measure,
     """
 
     if ax is None:
-        ax = plt.figure().add_subplot(111)
+        ax = _new_axes()
 
-    bins, bin_heights, bin_errs = ndanl.take_measure_by_bin(track_prop_dict,
-                                                  bin_property, measure, bins)
     bin_middles = list(map(lambda lower, upper: (lower + upper) / 2,
                            bins[:-1], bins[1:]))
 
@@ -120,7 +148,7 @@ def plot_property_bin_hist(track_prop_dict, track_property, bins=30,
             restriction is made in this code
         bins: either an int for the number of bins, a 3-tuple of the
             form (low_bound, high_bound, num_bins), or a list of
-            numbers. See ntupledict.operations.make_bins() for info
+            numbers. See ntupledicts.analyze.make_bins() for info
         legend_id: the entry in the legend for the line to be plotted.
             Calling ax.legend() should be done outside this function.
         ax: an axes object to overlay this data onto a previous plot
@@ -130,24 +158,108 @@ def plot_property_bin_hist(track_prop_dict, track_property, bins=30,
         and overlaying data
     """
 
-    if ax is None:
-        ax = plt.figure().add_subplot(111)
+    bins, bin_heights, bin_errs = ndanl.count_by_bin(
+            track_prop_dict[track_property], bins)
+
+    return draw_property_bin_hist(bins, bin_heights, bin_errs,
+                                  track_property, legend_id, ax)
 
-    ax = plot_measure_by_bin(track_prop_dict, track_property,
-                             lambda tpd: (len(tpd[track_property]),
-                                 sqrt(len(tpd[track_property]))),
-                             bins, legend_id, ax)
+
+def draw_property_bin_hist(bins, bin_heights, bin_errs, track_property,
+                           legend_id=None, ax=None):
+    """Draws the plot made by plot_property_bin_hist() from already
+    computed bin counts and errors.
+
+    Args:
+        bins: a list of bin edges.
+        bin_heights: a list of the number of tracks in each bin.
+        bin_errs: a list of the error in each bin.
+        track_property: the property histogrammed.
+        legend_id: the entry in the legend for the line to be plotted.
+            Calling ax.legend() should be done outside this function.
+        ax: an axes object to overlay this data onto a previous plot
+
+    Returns:
+        A matplotlib.pyplot.Axes object for adjusting plot properties
+        and overlaying data
+    """
+
+    ax = draw_measure_by_bin(bins, bin_heights, bin_errs, track_property,
+                             legend_id, ax)
     ax.set_ylabel("num. tracks")
     ax.set_title("Histrogram of {}".format(track_property))
 
     return ax
 
 
+def plot_property_2d_hist(track_prop_dict, x_property, y_property,
+                          x_bins=30, y_bins=30, log_counts=False, ax=None):
+    """Plot a 2D histogram of one track property against another. Use
+    this rather than a scatter plot for large track properties dicts:
+    the counts are found with numpy first, so the plot costs as much as
+    the number of bins rather than the number of tracks.
+
+    Args:
+        track_prop_dict: a track properties dict
+        x_property: the track property along the x axis
+        y_property: the track property along the y axis
+        x_bins, y_bins: either an int for the number of bins, a 3-tuple
+            of the form (low_bound, high_bound, num_bins), or a list of
+            numbers. See ntupledicts.analyze.make_bins() for info
+        log_counts: if True, color by the log of the counts
+        ax: an axes object to plot onto
+
+    Returns:
+        A matplotlib.pyplot.Axes object for adjusting plot properties
+    """
+
+    x_bins, y_bins, counts = ndanl.count_by_bin_2d(
+            track_prop_dict[x_property], track_prop_dict[y_property],
+            x_bins, y_bins)
+
+    return draw_property_2d_hist(x_bins, y_bins, counts, x_property,
+                                 y_property, log_counts, ax)
+
+
+def draw_property_2d_hist(x_bins, y_bins, counts, x_property, y_property,
+                          log_counts=False, ax=None):
+    """Draws the plot made by plot_property_2d_hist() from already
+    computed counts, such as the output of
+    ntupledicts.analyze.count_by_bin_2d().
+
+    Args:
+        x_bins: a list of bin edges along the x axis.
+        y_bins: a list of bin edges along the y axis.
+        counts: a 2D array of counts indexed by x bin, then y bin.
+        x_property: the track property along the x axis
+        y_property: the track property along the y axis
+        log_counts: if True, color by the log of the counts
+        ax: an axes object to plot onto
+
+    Returns:
+        A matplotlib.pyplot.Axes object for adjusting plot properties
+    """
+
+    from matplotlib.colors import LogNorm
+
+    if ax is None:
+        ax = _new_axes()
+
+    mesh = ax.pcolormesh(x_bins, y_bins, asarray(counts).T,
+            norm=LogNorm() if log_counts else None)
+    ax.figure.colorbar(mesh, ax=ax, label="num. tracks")
+    ax.set_xlabel(x_property)
+    ax.set_ylabel(y_property)
+
+    return ax
+
+
 def plot_property_scatter(track_prop_dict, track_property, legend_id=None,
         ax=None):
     """Plot a scatter plot of a track property in a track properties
     dict. Intended for track properties who take discrete values. Error
-    bars are simply one over the square root of a number of occurrences.
+    bars are the square root of the number of occurrences, as given by
+    ntupledicts.analyze.count_values().
 
     Args:
         track_prop_dict: a track properties dict
@@ -163,18 +275,38 @@ def plot_property_scatter(track_prop_dict, track_property, legend_id=None,
         and overlaying data
     """
 
-    if ax is None:
-        ax = plt.figure().add_subplot(111)
+    # Count occurrences of each value in one pass
+    values, counts, count_errs = ndanl.count_values(
+            track_prop_dict[track_property])
+
+    return draw_property_scatter(values, counts, count_errs, track_property,
+                                 legend_id, ax)
+
+
+def draw_property_scatter(values, counts, count_errs, track_property,
+                          legend_id=None, ax=None):
+    """Draws the plot made by plot_property_scatter() from already
+    counted values, such as the output of
+    ntupledicts.analyze.count_values().
+
+    Args:
+        values: a list of the distinct values of the track property.
+        counts: a list of the number of occurrences of each value.
+        count_errs: a list of the errors on those numbers.
+        track_property: the property counted.
+        legend_id: the entry in the legend for the line to be plotted.
+            Calling ax.legend() should be done outside this function.
+        ax: an axes object to overlay this data onto a previous plot
 
-    # Generate dict from values to number of occurences
-    val_list = track_prop_dict[track_property]
-    hist_dict = dict(map(lambda value:
-        (str(value), val_list.count(value)),
-        set(val_list)))
-    hist_yerr = list(map(lambda height: 1 / sqrt(height),
-        hist_dict.values()))
+    Returns:
+        A matplotlib.pyplot.Axes object for adjusting plot properties
+        and overlaying data
+    """
 
-    ax.errorbar(hist_dict.keys(), hist_dict.values(), yerr=hist_yerr,
+    if ax is None:
+        ax = _new_axes()
+
+    ax.errorbar(list(map(str, values)), counts, yerr=count_errs,
             label=legend_id, fmt=".")
     ax.set_yscale("log")  # we usually want log when we're counting
     ax.set_xlabel(track_property)
@@ -183,3 +315,11 @@ def plot_property_scatter(track_prop_dict, track_property, legend_id=None,
 
     return ax
 
+
+def _new_axes():
+    """Returns the axes of a new pyplot figure. pyplot is imported here,
+    on first use, so that importing this module stays fast."""
+
+    import matplotlib.pyplot as plt
+
+    return plt.figure().add_subplot(111)
@@ -0,0 +1,230 @@
+"""RENDER: render many plots at once, headless and in parallel.
+
+A nightly validation run can make hundreds of plots. Rather than drawing
+them one at a time through pyplot, describe each with a plot spec and
+hand the whole list to render_plots(). All of the plot data is computed
+first, in this process; then the figures are drawn and written to disk
+by a pool of worker processes using matplotlib's Agg backend, without
+ever touching pyplot's state machine.
+
+A plot spec is a dict of this form:
+
+    {"filename": "eff_by_eta.png",
+     "plot": ndplot.plot_measure_by_bin,
+     "args": [ntuple_dict["tp"], "eta", ndanl.eff_from_track_prop_dict],
+     "kwargs": {"bins": 20, "legend_id": "TTbar"}}
+
+The "plot" entry is one of the plot functions listed in
+supported_plot_functions(), and "args" and "kwargs" are what would be
+passed to it (leaving out ax). To overlay several plots on one set of
+axes, give a list of dicts with "plot", "args", and "kwargs" entries as
+"layers" instead. Specs can also have a "title", and "legend": True to
+draw a legend.
+"""
+
+from . import analyze as ndanl
+from . import plot as ndplot
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs
+from os.path import join
+from time import perf_counter
+
+
+def render_plots(plot_specs, output_dir, num_workers=None):
+    """Computes the data for every plot spec, then draws and saves all
+    of the figures in parallel worker processes.
+
+    Args:
+        plot_specs: a list of plot specs. See this module's docstring.
+        output_dir: the directory to write the figures to. Created if
+            it doesn't exist.
+        num_workers: the number of worker processes drawing figures. If
+            None, one per CPU.
+
+    Returns:
+        A dict with the total seconds spent preparing data ("prep_time")
+        and drawing and saving figures ("render_time"), as well as
+        "plot_times", a dict from each filename to a dict of its own
+        "prep" and "render" seconds. Render times of single plots are
+        measured inside the workers, so they can add up to more than
+        the total.
+
+    Raises:
+        ValueError: if a plot spec uses an unsupported plot function.
+    """
+
+    makedirs(output_dir, exist_ok=True)
+    plot_stages = _get_plot_stages()
+
+    # Compute all plot data up front
+    prep_start = perf_counter()
+    draw_calls_by_filename = {}
+    prep_times = {}
+    for plot_spec in plot_specs:
+        plot_start = perf_counter()
+        draw_calls_by_filename[plot_spec["filename"]] = list(map(
+            lambda layer: _prepare_layer(layer, plot_stages),
+            plot_spec.get("layers", [plot_spec])))
+        prep_times[plot_spec["filename"]] = perf_counter() - plot_start
+    prep_time = perf_counter() - prep_start
+
+    # Then draw them all in parallel
+    render_start = perf_counter()
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             initializer=_init_render_worker) as executor:
+        futures = list(map(lambda plot_spec:
+            executor.submit(_render_plot,
+                join(output_dir, plot_spec["filename"]),
+                draw_calls_by_filename[plot_spec["filename"]],
+                plot_spec.get("title"),
+                plot_spec.get("legend", False)),
+            plot_specs))
+        render_times = list(map(lambda future: future.result(), futures))
+    render_time = perf_counter() - render_start
+
+    return {"prep_time": prep_time,
+            "render_time": render_time,
+            "plot_times": dict(map(lambda plot_spec, plot_render_time:
+                (plot_spec["filename"],
+                    {"prep": prep_times[plot_spec["filename"]],
+                     "render": plot_render_time}),
+                plot_specs, render_times))}
+
+
+def supported_plot_functions():
+    """Returns a list of the plot functions that can be used in plot
+    specs."""
+
+    return list(_get_plot_stages().keys())
+
+
+def _prepare_layer(layer, plot_stages):
+    """Computes the data for one layer of a plot spec. Returns the draw
+    function and the keyword arguments to pass it."""
+
+    if layer["plot"] not in plot_stages:
+        raise ValueError("{} cannot be batch rendered. See "
+                "supported_plot_functions().".format(layer["plot"]))
+
+    prepare, draw = plot_stages[layer["plot"]]
+
+    return draw, prepare(*layer.get("args", []), **layer.get("kwargs", {}))
+
+
+def _get_plot_stages():
+    """Returns a dict from each supported plot function to a pair of
+    a function that computes its data (taking the same arguments, save
+    ax) and a function that draws it."""
+
+    # Imported here so that plots without ML don't pay for the import
+    from .ml import plot as ndmlplot
+
+    return {
+        ndplot.plot_roc_curve_from_cut_list:
+            (_prepare_roc_curve_from_cut_list,
+                ndplot.draw_roc_curve_from_cut_list),
+        ndplot.plot_measure_by_bin:
+            (_prepare_measure_by_bin, ndplot.draw_measure_by_bin),
+        ndplot.plot_property_bin_hist:
+            (_prepare_property_bin_hist, ndplot.draw_property_bin_hist),
+        ndplot.plot_property_2d_hist:
+            (_prepare_property_2d_hist, ndplot.draw_property_2d_hist),
+        ndplot.plot_property_scatter:
+            (_prepare_property_scatter, ndplot.draw_property_scatter),
+        ndmlplot.plot_rocs:
+            (_prepare_rocs, ndmlplot.draw_rocs),
+    }
+
+
+def _prepare_roc_curve_from_cut_list(ntuple_dict, cut_property, cuts,
+                                     cuts_constricting=True, group_name=None):
+    """Computes the keyword arguments for
+    ndplot.draw_roc_curve_from_cut_list()."""
+
+    effs, fake_rates = ndanl.effs_and_fake_rates_from_cut_list(
+            ntuple_dict, cut_property, cuts, cuts_constricting)
+    return {"cuts": cuts, "effs": effs, "fake_rates": fake_rates,
+            "group_name": group_name}
+
+
+def _prepare_measure_by_bin(track_prop_dict, bin_property, measure,
+                            bins=30, legend_id=None, executor=None):
+    """Computes the keyword arguments for ndplot.draw_measure_by_bin()."""
+
+    bins, bin_heights, bin_errs = ndanl.take_measure_by_bin(
+            track_prop_dict, bin_property, measure, bins, executor)
+    return {"bins": bins, "bin_heights": bin_heights, "bin_errs": bin_errs,
+            "bin_property": bin_property, "legend_id": legend_id}
+
+
+def _prepare_property_bin_hist(track_prop_dict, track_property, bins=30,
+                               legend_id=None):
+    """Computes the keyword arguments for ndplot.draw_property_bin_hist()."""
+
+    bins, bin_heights, bin_errs = ndanl.count_by_bin(
+            track_prop_dict[track_property], bins)
+    return {"bins": bins, "bin_heights": bin_heights, "bin_errs": bin_errs,
+            "track_property": track_property, "legend_id": legend_id}
+
+
+def _prepare_property_2d_hist(track_prop_dict, x_property, y_property,
+                              x_bins=30, y_bins=30, log_counts=False):
+    """Computes the keyword arguments for ndplot.draw_property_2d_hist()."""
+
+    x_bins, y_bins, counts = ndanl.count_by_bin_2d(
+            track_prop_dict[x_property], track_prop_dict[y_property],
+            x_bins, y_bins)
+    return {"x_bins": x_bins, "y_bins": y_bins, "counts": counts,
+            "x_property": x_property, "y_property": y_property,
+            "log_counts": log_counts}
+
+
+def _prepare_property_scatter(track_prop_dict, track_property,
+                              legend_id=None):
+    """Computes the keyword arguments for ndplot.draw_property_scatter()."""
+
+    values, counts, count_errs = ndanl.count_values(
+            track_prop_dict[track_property])
+    return {"values": values, "counts": counts, "count_errs": count_errs,
+            "track_property": track_property, "legend_id": legend_id}
+
+
+def _prepare_rocs(dataset, prob_pred_names=[], def_pred_names=[],
+                  xlims=(0, .3), ylims=(.9, 1)):
+    """Computes the keyword arguments for ndmlplot.draw_rocs()."""
+
+    from .ml import plot as ndmlplot
+
+    roc_curves, cut_points = ndmlplot.compute_rocs(dataset,
+            prob_pred_names, def_pred_names)
+    return {"roc_curves": roc_curves, "cut_points": cut_points,
+            "xlims": xlims, "ylims": ylims}
+
+
+def _init_render_worker():
+    """Makes sure a render worker process draws without a display."""
+
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _render_plot(path, draw_calls, title=None, legend=False):
+    """Draws one figure from its draw calls and saves it to path, using
+    a bare Agg canvas rather than pyplot. Returns the seconds taken."""
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    render_start = perf_counter()
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    for draw, draw_kwargs in draw_calls:
+        draw(ax=ax, **draw_kwargs)
+    if title is not None:
+        ax.set_title(title)
+    if legend:
+        ax.legend()
+    figure.savefig(path)
+
+    return perf_counter() - render_start
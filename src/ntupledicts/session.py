@@ -0,0 +1,530 @@
+"""SESSION: plan many analyses and run them in one pass over the data.
+
+Each function in ntupledicts.analyze and ntupledicts.plot scans the data
+on its own, so a script with forty plots makes forty or more passes.
+An AnalysisSession instead takes a list of everything wanted up front
+(histograms, binned measures, efficiencies, ROC scans), then computes
+them all in a single scan in which each value list is converted, each
+selector is evaluated, and each binning is assigned only once. The data
+can also be streamed through the session chunk by chunk.
+
+    session = AnalysisSession()
+    session.add_hist("trk_eta", "trk", "eta", bins=(-2.4, 2.4, 24))
+    session.add_binned_eff("eff_by_eta", "eta", bins=(-2.4, 2.4, 24))
+    session.add_roc_scan("chi2_roc", "chi2", chi2_cuts)
+    session.run(ntuple_dict)  # or an iterable of ntuple dict chunks
+    session.draw("eff_by_eta", legend_id="TTbar")
+"""
+
+from . import analyze as ndanl
+from . import plot as ndplot
+from .operations import select as sel
+from .operations import val_list_mask
+from numpy import asarray
+from numpy import bincount
+from numpy import ones
+from numpy import searchsorted
+from numpy import sqrt as sqrt_array
+from numpy import zeros
+from warnings import warn
+
+
+class AnalysisSession:
+    """A set of named analyses of an ntuple dict that are all computed
+    together by run().
+
+    Binned analyses accept the same bin specifiers as
+    ntupledicts.analyze.make_bins(). When streaming more than one chunk,
+    every chunk must be binned the same way, so bins must then be given
+    explicitly as a (low_bound, high_bound, num_bins) tuple or a list of
+    edges. Binned measures with an arbitrary measure function need all
+    of the data at once and so can't be streamed at all.
+    """
+
+    def __init__(self):
+        """Makes a session with no analyses."""
+
+        self._analyses = {}
+        self._results = {}
+
+    # ANALYSES
+
+    def add_hist(self, name, track_type, track_property, bins=30):
+        """Adds a histogram of a track property, with errors that are
+        the square root of the count in each bin.
+
+        Args:
+            name: a name by which to reference the result.
+            track_type: a track type ("trk", "tp", etc.).
+            track_property: the property to histogram.
+            bins: a bin specifier. See ntupledicts.analyze.make_bins().
+        """
+
+        self._add_analysis(name, "hist", track_type=track_type,
+                bin_property=track_property, bins=bins)
+
+    def add_binned_eff(self, name, bin_property, bins=30,
+                       selector_dict=None):
+        """Adds the tracking efficiency binned by a tracking particle
+        property. The tp track properties dict must contain nmatch.
+
+        Args:
+            name: a name by which to reference the result.
+            bin_property: the tp property to bin by.
+            bins: a bin specifier. See ntupledicts.analyze.make_bins().
+            selector_dict: a dictionary from tp properties to selectors
+                restricting which tps count towards the efficiency.
+        """
+
+        self._add_analysis(name, "binned_eff", track_type="tp",
+                bin_property=bin_property, bins=bins,
+                selector_dict=selector_dict or {})
+
+    def add_binned_mean(self, name, track_type, bin_property, mean_property,
+                        bins=30):
+        """Adds the mean of one track property binned by another, with
+        errors that are the standard error of the mean.
+
+        Args:
+            name: a name by which to reference the result.
+            track_type: a track type ("trk", "tp", etc.).
+            bin_property: the property to bin by.
+            mean_property: the property to take the mean of.
+            bins: a bin specifier. See ntupledicts.analyze.make_bins().
+        """
+
+        self._add_analysis(name, "binned_mean", track_type=track_type,
+                bin_property=bin_property, bins=bins,
+                mean_property=mean_property)
+
+    def add_binned_measure(self, name, track_type, bin_property, measure,
+                           bins=30):
+        """Adds an arbitrary measure binned by a track property, as in
+        ntupledicts.analyze.take_measure_by_bin(). Cannot be streamed.
+
+        Args:
+            name: a name by which to reference the result.
+            track_type: a track type ("trk", "tp", etc.).
+            bin_property: the property to bin by.
+            measure: a function that takes in a track properties dict
+                and returns a number and an error.
+            bins: a bin specifier. See ntupledicts.analyze.make_bins().
+        """
+
+        self._add_analysis(name, "binned_measure", track_type=track_type,
+                bin_property=bin_property, bins=bins, measure=measure)
+
+    def add_eff(self, name, selector_dict=None):
+        """Adds the tracking efficiency and its error, as in
+        ntupledicts.analyze.eff_from_track_prop_dict().
+
+        Args:
+            name: a name by which to reference the result.
+            selector_dict: a dictionary from tp properties to selectors
+                restricting which tps count towards the efficiency.
+        """
+
+        self._add_analysis(name, "eff", track_type="tp",
+                selector_dict=selector_dict or {})
+
+    def add_roc_scan(self, name, cut_property, cuts, cuts_constricting=True):
+        """Adds the efficiencies and fake rates after each of a list of
+        cuts, as in ntupledicts.plot.plot_roc_curve_from_cut_list().
+
+        Args:
+            name: a name by which to reference the result.
+            cut_property: the variable to change cuts on.
+            cuts: a list of length 2 lists containing lower and upper
+                cut bounds (inclusive).
+            cuts_constricting: if True, each cut is applied on top of
+                all the cuts before it.
+        """
+
+        self._add_analysis(name, "roc_scan", cut_property=cut_property,
+                cuts=cuts, cuts_constricting=cuts_constricting)
+
+    def get_analysis_names(self):
+        """Returns a list of the names of all analyses in this
+        session."""
+
+        return list(self._analyses.keys())
+
+    def _add_analysis(self, name, kind, **settings):
+        """Adds an analysis of the given kind with the given settings,
+        replacing any by the same name."""
+
+        if name in self._analyses:
+            warn("Replacing analysis {}.".format(name), UserWarning)
+
+        self._analyses[name] = dict(settings, kind=kind)
+        self._results.pop(name, None)
+
+    # RUNNING
+
+    def run(self, ntuple_dicts):
+        """Computes every analysis in this session in one scan over the
+        data, or in one scan per chunk.
+
+        Args:
+            ntuple_dicts: an ntuple dict, or an iterable of ntuple dicts
+                that are chunks of the same sample.
+
+        Returns:
+            A dict from analysis names to results. See get_result().
+
+        Raises:
+            ValueError: if no chunks are given, or if more than one
+                chunk is given and an analysis can't be streamed.
+        """
+
+        if isinstance(ntuple_dicts, dict):
+            ntuple_dicts = [ntuple_dicts]
+
+        tallies = dict(map(lambda name: (name, None), self._analyses.keys()))
+        bin_edges = {}
+        chunk_scan = None
+        for chunk_index, ntuple_dict in enumerate(ntuple_dicts):
+            chunk_scan = _ChunkScan(ntuple_dict, bin_edges, chunk_index > 0)
+            for name, analysis in self._analyses.items():
+                tallies[name] = _tally_chunk[analysis["kind"]](
+                        analysis, chunk_scan, tallies[name])
+        if chunk_scan is None:
+            raise ValueError("No ntuple dicts to run the session on.")
+
+        self._results = dict(map(lambda name, analysis:
+            (name, _finish_tally[analysis["kind"]](analysis, tallies[name],
+                bin_edges)),
+            self._analyses.keys(), self._analyses.values()))
+
+        return dict(self._results)
+
+    def get_result(self, name):
+        """Returns the result of an analysis from the last run().
+
+        Histograms and binned analyses give a dict with "bins",
+        "bin_heights", and "bin_errs". Efficiencies give a tuple of the
+        efficiency and its error. ROC scans give a dict with "cuts",
+        "effs", and "fake_rates".
+
+        Raises:
+            ValueError: if there is no result by that name.
+        """
+
+        if name not in self._results:
+            raise ValueError("No result for {}; has the session been run?"
+                    .format(name))
+
+        return self._results[name]
+
+    def draw(self, name, legend_id=None, ax=None):
+        """Draws the result of an analysis using the matching draw
+        function from ntupledicts.plot.
+
+        Args:
+            name: the name of an analysis.
+            legend_id: the entry in the legend for the plotted data.
+            ax: an axes object to overlay this data onto a previous
+                plot.
+
+        Returns:
+            The axes object used to plot the result.
+
+        Raises:
+            ValueError: if there is no result by that name, or if the
+                result can't be plotted (a lone efficiency).
+        """
+
+        result = self.get_result(name)
+        analysis = self._analyses[name]
+
+        if analysis["kind"] == "hist":
+            return ndplot.draw_property_bin_hist(result["bins"],
+                    result["bin_heights"], result["bin_errs"],
+                    analysis["bin_property"], legend_id, ax)
+        if analysis["kind"] == "roc_scan":
+            return ndplot.draw_roc_curve_from_cut_list(result["cuts"],
+                    result["effs"], result["fake_rates"], legend_id, ax)
+        if analysis["kind"] == "eff":
+            raise ValueError("{} is a single efficiency and can't be drawn."
+                    .format(name))
+
+        return ndplot.draw_measure_by_bin(result["bins"],
+                result["bin_heights"], result["bin_errs"],
+                analysis["bin_property"], legend_id, ax)
+
+
+class _ChunkScan:
+    """Everything the analyses of a session need from one chunk of data,
+    each computed at most once: value lists as numpy arrays, selector
+    dict masks, and bin assignments."""
+
+    def __init__(self, ntuple_dict, bin_edges, streaming):
+        """Wraps an ntuple dict. bin_edges is a dict shared between the
+        chunks of a run from binning keys to the bin edges fixed by the
+        first chunk. streaming is True for every chunk after the
+        first."""
+
+        self.ntuple_dict = ntuple_dict
+        self.streaming = streaming
+        self._bin_edges = bin_edges
+        self._val_arrays = {}
+        self._selector_masks = {}
+        self._bin_indices = {}
+
+    def get_val_array(self, track_type, track_property):
+        """Returns a value list as a numpy array."""
+
+        key = (track_type, track_property)
+        if key not in self._val_arrays:
+            self._val_arrays[key] = asarray(
+                    self.ntuple_dict[track_type][track_property])
+
+        return self._val_arrays[key]
+
+    def get_selected(self, track_type, selector_dict):
+        """Returns a boolean array of the tracks selected by all of the
+        selectors in a selector dict."""
+
+        track_prop_dict = self.ntuple_dict[track_type]
+        selected = ones(len(next(iter(track_prop_dict.values()))),
+                dtype=bool)
+        for track_property, selector in selector_dict.items():
+            if track_property not in track_prop_dict.keys():
+                warn("{} not in tracks properties; will not select"
+                        .format(track_property), UserWarning)
+                continue
+            key = (track_type, track_property, id(selector))
+            if key not in self._selector_masks:
+                self._selector_masks[key] = val_list_mask(
+                        self.get_val_array(track_type, track_property),
+                        selector)
+            selected &= self._selector_masks[key]
+
+        return selected
+
+    def get_bins(self, track_type, bin_property, bins):
+        """Returns the bin edges and an array of bin indices by track.
+        Bin edges are fixed by the first chunk of a run. Chunks are
+        binned here rather than through ndanl.bin_val_list(), whose
+        cache would keep every chunk's value list alive.
+
+        Raises:
+            ValueError: if streaming and the bins weren't explicit.
+        """
+
+        binning_key = _binning_key(track_type, bin_property, bins)
+        if binning_key not in self._bin_indices:
+            if binning_key in self._bin_edges:
+                if not (isinstance(bins, list)
+                        or isinstance(bins, tuple) and len(bins) == 3):
+                    raise ValueError("Streaming analysis of {} needs "
+                            "explicit bins, not {}."
+                            .format(bin_property, bins))
+                bins = self._bin_edges[binning_key]
+            val_array = self.get_val_array(track_type, bin_property)
+            bin_edges = ndanl.make_bins(bins, val_array)
+            self._bin_edges[binning_key] = list(bin_edges)
+            self._bin_indices[binning_key] = searchsorted(bin_edges,
+                    val_array, side="right") - 1
+
+        return self._bin_edges[binning_key], self._bin_indices[binning_key]
+
+    def get_matched(self):
+        """Returns a boolean array of which tps were matched."""
+
+        return self.get_selected("tp", {"nmatch": _matched_selector})
+
+
+_matched_selector = sel(0, invert=True)
+
+
+def _binning_key(track_type, bin_property, bins):
+    """Returns a hashable key for binning a value list a certain way."""
+
+    return (track_type, bin_property, ndanl._bin_specifier_key(bins))
+
+
+def _count_by_bin(bin_edges, bin_indices, selected=None, weights=None):
+    """Sums weights (or counts tracks) in each bin over the selected
+    tracks, ignoring tracks outside of the bins."""
+
+    num_bins = len(bin_edges) - 1
+    in_bins = (bin_indices >= 0) & (bin_indices < num_bins)
+    if selected is not None:
+        in_bins &= selected
+
+    return bincount(bin_indices[in_bins],
+            weights=None if weights is None else weights[in_bins],
+            minlength=num_bins)
+
+
+def _add_tallies(tally, chunk_tally):
+    """Adds one chunk's tally (a tuple of arrays or lists of counts) to
+    the running tally."""
+
+    if tally is None:
+        return chunk_tally
+
+    return tuple(map(lambda counts, chunk_counts:
+        asarray(counts) + asarray(chunk_counts),
+        tally, chunk_tally))
+
+
+def _tally_hist(analysis, chunk_scan, tally):
+    """Adds a chunk's bin counts to a histogram's tally."""
+
+    bin_edges, bin_indices = chunk_scan.get_bins(analysis["track_type"],
+            analysis["bin_property"], analysis["bins"])
+    return _add_tallies(tally, (_count_by_bin(bin_edges, bin_indices),))
+
+
+def _tally_binned_eff(analysis, chunk_scan, tally):
+    """Adds a chunk's tp and matched tp counts by bin to a tally."""
+
+    bin_edges, bin_indices = chunk_scan.get_bins("tp",
+            analysis["bin_property"], analysis["bins"])
+    selected = chunk_scan.get_selected("tp", analysis["selector_dict"])
+    return _add_tallies(tally, (
+        _count_by_bin(bin_edges, bin_indices, selected),
+        _count_by_bin(bin_edges, bin_indices,
+            selected & chunk_scan.get_matched())))
+
+
+def _tally_binned_mean(analysis, chunk_scan, tally):
+    """Adds a chunk's counts, sums, and sums of squares by bin to a
+    tally."""
+
+    bin_edges, bin_indices = chunk_scan.get_bins(analysis["track_type"],
+            analysis["bin_property"], analysis["bins"])
+    vals = chunk_scan.get_val_array(analysis["track_type"],
+            analysis["mean_property"]).astype(float)
+    return _add_tallies(tally, (
+        _count_by_bin(bin_edges, bin_indices),
+        _count_by_bin(bin_edges, bin_indices, weights=vals),
+        _count_by_bin(bin_edges, bin_indices, weights=vals ** 2)))
+
+
+def _tally_binned_measure(analysis, chunk_scan, tally):
+    """Takes an arbitrary binned measure of the only chunk."""
+
+    if chunk_scan.streaming:
+        raise ValueError("Binned measures with a measure function can't "
+                "be streamed.")
+    # Fixes the bin edges of the result
+    chunk_scan.get_bins(analysis["track_type"], analysis["bin_property"],
+            analysis["bins"])
+    return ndanl.take_measure_by_bin(
+            chunk_scan.ntuple_dict[analysis["track_type"]],
+            analysis["bin_property"], analysis["measure"], analysis["bins"])
+
+
+def _tally_eff(analysis, chunk_scan, tally):
+    """Adds a chunk's tp and matched tp counts to a tally."""
+
+    selected = chunk_scan.get_selected("tp", analysis["selector_dict"])
+    return _add_tallies(tally, (
+        selected.sum(), (selected & chunk_scan.get_matched()).sum()))
+
+
+def _tally_roc_scan(analysis, chunk_scan, tally):
+    """Adds a chunk's track counts after each cut to a tally."""
+
+    return _add_tallies(tally, ndanl.counts_from_cut_list(
+        chunk_scan.ntuple_dict, analysis["cut_property"], analysis["cuts"],
+        analysis["cuts_constricting"]))
+
+
+_tally_chunk = {
+    "hist": _tally_hist,
+    "binned_eff": _tally_binned_eff,
+    "binned_mean": _tally_binned_mean,
+    "binned_measure": _tally_binned_measure,
+    "eff": _tally_eff,
+    "roc_scan": _tally_roc_scan,
+}
+
+
+def _proportions_and_errs(num_counted, num_tracks):
+    """Returns lists of proportions and their prediction errors, zero
+    where there are no tracks."""
+
+    return (list(map(lambda counted, tracks:
+                counted / tracks if tracks else 0,
+                num_counted.tolist(), num_tracks.tolist())),
+            list(map(lambda counted, tracks:
+                ndanl.pred_error(tracks, counted),
+                num_counted.tolist(), num_tracks.tolist())))
+
+
+def _finish_hist(analysis, tally, bin_edges):
+    """Turns a histogram's tally into its result."""
+
+    counts, = tally
+    return {"bins": bin_edges[_binning_key(analysis["track_type"],
+                analysis["bin_property"], analysis["bins"])],
+            "bin_heights": counts.tolist(),
+            "bin_errs": sqrt_array(counts).tolist()}
+
+
+def _finish_binned_eff(analysis, tally, bin_edges):
+    """Turns a binned efficiency's tally into its result."""
+
+    num_tps, num_matched_tps = tally
+    effs, eff_errs = _proportions_and_errs(num_matched_tps, num_tps)
+    return {"bins": bin_edges[_binning_key("tp", analysis["bin_property"],
+                analysis["bins"])],
+            "bin_heights": effs,
+            "bin_errs": eff_errs}
+
+
+def _finish_binned_mean(analysis, tally, bin_edges):
+    """Turns a binned mean's tally into its result."""
+
+    counts, sums, sums_of_squares = tally
+    nonempty = counts > 0
+    means = zeros(len(counts))
+    means[nonempty] = sums[nonempty] / counts[nonempty]
+    mean_errs = zeros(len(counts))
+    mean_errs[nonempty] = sqrt_array(abs(
+        sums_of_squares[nonempty] / counts[nonempty]
+        - means[nonempty] ** 2) / counts[nonempty])
+    return {"bins": bin_edges[_binning_key(analysis["track_type"],
+                analysis["bin_property"], analysis["bins"])],
+            "bin_heights": means.tolist(),
+            "bin_errs": mean_errs.tolist()}
+
+
+def _finish_binned_measure(analysis, tally, bin_edges):
+    """Turns a binned measure's tally into its result."""
+
+    bins, bin_heights, bin_errs = tally
+    return {"bins": bins, "bin_heights": bin_heights, "bin_errs": bin_errs}
+
+
+def _finish_eff(analysis, tally, bin_edges):
+    """Turns an efficiency's tally into its result."""
+
+    num_tps, num_matched_tps = map(int, tally)
+    if not num_tps:
+        return 0, 0
+    return (num_matched_tps / num_tps,
+            ndanl.pred_error(num_tps, num_matched_tps))
+
+
+def _finish_roc_scan(analysis, tally, bin_edges):
+    """Turns a ROC scan's tally into its result."""
+
+    num_trks, num_fake_trks, num_tps, num_matched_tps = map(asarray, tally)
+    effs, _ = _proportions_and_errs(num_matched_tps, num_tps)
+    fake_rates, _ = _proportions_and_errs(num_fake_trks, num_trks)
+    return {"cuts": analysis["cuts"], "effs": effs, "fake_rates": fake_rates}
+
+
+_finish_tally = {
+    "hist": _finish_hist,
+    "binned_eff": _finish_binned_eff,
+    "binned_mean": _finish_binned_mean,
+    "binned_measure": _finish_binned_measure,
+    "eff": _finish_eff,
+    "roc_scan": _finish_roc_scan,
+}
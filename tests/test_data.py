@@ -0,0 +1,37 @@
+from ntupledicts.ml.data import TrackPropertiesDataset
+from numpy import concatenate
+from numpy import sort
+from numpy import arange
+
+
+def make_rare_label_dataset():
+    """A dataset of 100 tracks, 4 of which are genuine."""
+
+    return TrackPropertiesDataset(
+        {"pt": list(range(100)), "genuine": [1] * 4 + [0] * 96},
+        "genuine", ["pt"])
+
+
+def test_kfold_spreads_label_rarer_than_k():
+    tpds = make_rare_label_dataset()
+    labels = tpds.to_track_prop_dict(copy=False)["genuine"]
+
+    test_folds = list(map(lambda fold: fold[1],
+                          tpds.kfold_indices(5, stratify=True, seed=0)))
+
+    assert list(map(len, test_folds)) == [20] * 5
+    assert sorted(map(lambda fold: int(labels[fold].sum()),
+                      test_folds)) == [0, 1, 1, 1, 1]
+    assert (sort(concatenate(test_folds)) == arange(100)).all()
+
+
+def test_stratified_split_sizes_differ_by_at_most_one_per_label():
+    tpds = make_rare_label_dataset()
+    labels = tpds.to_track_prop_dict(copy=False)["genuine"]
+
+    parts = tpds.split_indices([1] * 3, shuffle=True, stratify=True, seed=0)
+
+    for label in (0, 1):
+        label_counts = list(map(lambda part: int((labels[part] == label)
+                                                 .sum()), parts))
+        assert max(label_counts) - min(label_counts) <= 1